@@ -0,0 +1,79 @@
+"""
+    Runs the searches in a separate process, so that they do not compete
+    with the game loop for the GIL.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Array, Value
+
+from database import DATABASE_FILE, build
+from solver import Progress, search
+
+# Shared with the worker process, set by _init_worker
+_latest = None  # id of the latest search, older searches are cancelled
+# The latest progress reported, as the search id followed by the fields of Progress.
+# Only the latest is kept, so nothing piles up when the progress is not read.
+_progress = None
+
+
+def _init_worker(latest, progress):
+    global _latest, _progress
+    _latest, _progress = latest, progress
+
+
+def _search(search_id, state, engine):
+    # Runs the search while it is the latest one, reporting its progress.
+    # Returns the path of states, None if unsolvable or cancelled.
+    running = search(state, engine)
+    try:
+        while True:
+            progress = next(running)
+            if _latest.value != search_id:
+                running.close()
+                return None
+            with _progress.get_lock():
+                _progress[:] = [search_id, *progress]
+    except StopIteration as stop:
+        return stop.value
+
+
+class SolverProcess:
+    """
+        Runs one search at a time in a worker process.
+        Submitting a new search, or calling cancel(), stops the search in progress
+        at its next progress event, instead of letting it run to the end.
+    """
+
+    def __init__(self):
+        self.latest = Value('i', 0)
+        # no search has reported yet, see _progress
+        self.latest_progress = Array('q', [-1] + [0] * len(Progress._fields))
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                            initargs=(self.latest, self.latest_progress))
+
+    def submit(self, state, engine):
+        # Starts searching from the encoded state, returns a future of the path of states
+        self.cancel()
+        return self.executor.submit(_search, self.latest.value, state, engine)
+
+    def cancel(self):
+        with self.latest.get_lock():
+            self.latest.value += 1
+
+    def poll(self):
+        # Returns the latest Progress of the latest search, None before its first one
+        with self.latest_progress.get_lock():
+            search_id, *progress = self.latest_progress[:]
+        return Progress(*progress) if search_id == self.latest.value else None
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
+
+def build_table(path=DATABASE_FILE):
+    # Builds the distance table in a worker process of its own, returns a future of the build
+    executor = ProcessPoolExecutor(max_workers=1)
+    future = executor.submit(build, path)
+    # the worker exits once the table is built
+    executor.shutdown(wait=False)
+    return future
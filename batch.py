@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+    Solves many layouts headlessly, across a pool of processes.
+
+    Layouts are read one per line, either as JSON
+        {"id": "start", "layout": [["1x1", 0, 4], ["1x1", 1, 3], ..., ["2x2", 1, 0]]}
+    (or just the list of pieces), or as text
+        1x1 0 4, 1x1 1 3, ..., 2x2 1 0
+    Empty lines and lines starting with # are skipped. Lines which cannot be read are
+    reported with an error, like invalid layouts, and the other layouts are still solved.
+    Layouts without an id get the id line-N, N being their line in the file.
+
+    A JSON line is written for every layout as soon as it is solved, holding the optimal
+    number of moves, the moves as [x, y, new_x, new_y] of the moved piece, the number of
+    states expanded and the wall time in seconds.
+"""
+import json
+import sys
+import time
+from argparse import ArgumentParser, FileType
+from multiprocessing import Pool
+
+from bitboard import decode_move, encode
+from game import Board, POSITIONS
+from solver import SEARCHES, search
+
+
+def parse_layout(line):
+    # Returns (id, layout, error) of a line, None for lines to skip.
+    # id is None unless the line gives one, error is the reason the line could not be read.
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    layout_id = None
+    try:
+        if line[0] in '[{':
+            data = json.loads(line)
+            if isinstance(data, dict):
+                layout_id = data.get('id')
+                if 'layout' not in data:
+                    raise ValueError('no layout')
+                data = data['layout']
+            return layout_id, data, None
+        return None, [(name, int(x), int(y)) for name, x, y in (piece.split() for piece in line.split(','))], None
+    except (TypeError, ValueError) as e:
+        return layout_id, None, f'Cannot read line: {e}'
+
+
+def read_layouts(lines):
+    # Yields (id, layout, error), see parse_layout. Layouts without an id are named
+    # after their line in the file, as 'line-N', so they cannot be mistaken for given ids.
+    for number, line in enumerate(lines, 1):
+        parsed = parse_layout(line)
+        if parsed is not None:
+            layout_id, layout, error = parsed
+            yield layout_id if layout_id is not None else f'line-{number}', layout, error
+
+
+def solve_layout(task):
+    # runs in the worker processes, returns the result as a dict
+    layout_id, layout, error, engine = task
+    if error is not None:
+        return {'id': layout_id, 'error': error}
+    start = time.perf_counter()
+    try:
+        state = encode(Board.from_layout(layout))
+    except (KeyError, TypeError, ValueError) as e:
+        return {'id': layout_id, 'error': str(e)}
+
+    running = search(state, engine)
+    expanded = 0
+    try:
+        while True:
+            expanded = next(running).expanded
+    except StopIteration as stop:
+        path = stop.value
+
+    result = {'id': layout_id, 'length': None, 'moves': None}
+    if path is not None:
+        moves = []
+        for _state, new_state in zip(path, path[1:]):
+            _, source, destination = decode_move(_state, new_state)
+            moves.append([*POSITIONS[source], *POSITIONS[destination]])
+        result.update(length=len(moves), moves=moves)
+    result.update(expanded=expanded, time=round(time.perf_counter() - start, 4))
+    return result
+
+
+def solve_layouts(layouts, engine='bfs', processes=None):
+    # yields the results as they are ready, in any order
+    tasks = ((layout_id, layout, error, engine) for layout_id, layout, error in layouts)
+    with Pool(processes) as pool:
+        yield from pool.imap_unordered(solve_layout, tasks)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Solves klotski layouts in bulk.')
+    parser.add_argument('input', type=FileType('r'), help='file of layouts (JSONL or text), - for stdin')
+    parser.add_argument('--output', type=FileType('w'), default=sys.stdout, help='file for the results. default: stdout')
+    parser.add_argument('--solver', default='bfs', choices=list(SEARCHES), help='search engine. default: bfs')
+    parser.add_argument('--processes', type=int, default=None, help='number of workers. default: number of cores')
+    args = parser.parse_args()
+
+    for result in solve_layouts(read_layouts(args.input), args.solver, args.processes):
+        args.output.write(json.dumps(result) + '\n')
+        args.output.flush()
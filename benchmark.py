@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+    Reproducible benchmarks of the hot paths: solvers, move generation and rendering.
+
+        ./benchmark.py --output bench.json
+        ./benchmark.py --compare bench.json
+
+    Every benchmark runs in a fresh process, so the peak RSS reported is its own.
+    Results are written as JSON, to be compared across commits with --compare.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from multiprocessing import get_context
+
+from bitboard import encode, shape_counts
+from game import Board
+from solver import SOLVERS, SearchStats, explore_states, goal_components
+
+# Positions along the optimal solution from the start, by the number of steps taken
+LAYOUTS = {
+    'start': None,
+    'step20': [('1x1', 3, 4), ('1x1', 2, 4), ('1x1', 1, 2), ('1x1', 0, 2), ('1x2', 0, 0),
+               ('1x2', 2, 2), ('1x2', 3, 0), ('1x2', 3, 2), ('2x1', 0, 3), ('2x2', 1, 0)],
+    'step40': [('1x1', 2, 3), ('1x1', 0, 2), ('1x1', 0, 1), ('1x1', 0, 0), ('1x2', 1, 3),
+               ('1x2', 0, 3), ('1x2', 3, 0), ('1x2', 3, 2), ('2x1', 2, 4), ('2x2', 1, 0)],
+    'step60': [('1x1', 0, 4), ('1x1', 1, 0), ('1x1', 1, 1), ('1x1', 1, 4), ('1x2', 0, 2),
+               ('1x2', 0, 0), ('1x2', 2, 0), ('1x2', 3, 0), ('2x1', 2, 4), ('2x2', 1, 2)],
+}
+# runs of each benchmark, the best one is reported
+REPEAT = 3
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    # Registers a benchmark, which returns (wall time, nodes processed, calls made)
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def best_of(function, repeat=REPEAT):
+    # best wall time of the runs
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _board(position):
+    layout = LAYOUTS[position]
+    return Board.from_start_position() if layout is None else Board.from_layout(layout)
+
+
+def _solver_benchmark(engine, position, setup=None):
+    # setup runs before every timed run, and is timed along with it
+    def run():
+        solver = SOLVERS[engine]
+
+        def solve():
+            if setup is not None:
+                setup()
+            solver(_board(position))
+        wall = best_of(solve)
+        stats = SearchStats()
+        solver(_board(position), stats=stats)
+        return wall, stats.expanded, 1
+    return run
+
+
+for _position in LAYOUTS:
+    benchmark(f'bfs_solver/{_position}')(_solver_benchmark('bfs', _position))
+# Cold, as in a new process: the goal components are labelled again for every run
+for _position in LAYOUTS:
+    benchmark(f'bidirectional_solver/{_position}')(
+        _solver_benchmark('bidirectional', _position, setup=goal_components.cache_clear))
+
+
+@benchmark('goal_components')
+def goal_components_benchmark():
+    # built once for a set of pieces by the first bidirectional search of a process
+    counts = shape_counts(encode(Board.from_start_position()))
+
+    def run():
+        goal_components.cache_clear()
+        goal_components(counts)
+    return best_of(run), len(goal_components(counts)[0]), 1
+
+
+@benchmark('explore_states')
+def explore_benchmark():
+    with redirect_stdout(StringIO()):
+        _, visited = explore_states()
+        wall = best_of(explore_states)
+    return wall, visited.count(1), 1
+
+
+@benchmark('possible_moves')
+def possible_moves_benchmark(calls=10000):
+    board = Board.from_start_position()
+    empty_positions = board.empty_positions()
+
+    def run():
+        for _ in range(calls // len(board.pieces)):
+            for piece in board.pieces:
+                piece.possible_moves(empty_positions)
+    return best_of(run), None, calls
+
+
+@benchmark('empty_positions')
+def empty_positions_benchmark(calls=10000):
+    board = Board.from_start_position()
+
+    def run():
+        for _ in range(calls):
+            board.empty_positions()
+    return best_of(run), None, calls
+
+
+def _draw_benchmark(calls, full):
+    # frames of the game, drawn headless
+    def run_benchmark():
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        import pygame
+        import main
+        win = pygame.display.set_mode((main.WIDTH, main.HEIGHT))
+        board = Board.from_start_position()
+        renderer, solver, loader = main.Renderer(win), main.AutoSolver(board), main.Loader()
+
+        def run():
+            for _ in range(calls):
+                if full:
+                    renderer.invalidate()
+                renderer.draw(board, solver, loader)
+        return best_of(run), None, calls
+    return run_benchmark
+
+
+# idle frames redraw nothing, full frames redraw the whole window
+benchmark('draw')(_draw_benchmark(200, full=False))
+benchmark('draw/full')(_draw_benchmark(200, full=True))
+
+
+def peak_rss():
+    # peak resident set size of the process in KB, None where unsupported
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS, KB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_benchmark(name):
+    # runs in a fresh process
+    try:
+        wall, nodes, calls = BENCHMARKS[name]()
+    except ImportError as e:
+        return {'skipped': str(e)}
+    return {
+        'wall': wall,
+        'per_call': wall / calls,
+        'nodes': nodes,
+        'nodes_per_sec': nodes / wall if nodes else None,
+        'peak_rss_kb': peak_rss(),
+    }
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names):
+    results = {}
+    context = get_context('spawn')
+    for name in names:
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(run_benchmark, (name,))
+        print(name, format_result(results[name]))
+    return {'commit': commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'results': results}
+
+
+def format_result(result):
+    if 'skipped' in result:
+        return f"skipped ({result['skipped']})"
+    text = f"{result['wall'] * 1000:.2f} ms, {result['per_call'] * 1e6:.2f} us/call"
+    if result['nodes_per_sec']:
+        text += f", {result['nodes_per_sec']:.0f} nodes/s"
+    if result['peak_rss_kb']:
+        text += f", peak rss {result['peak_rss_kb'] / 1024:.1f} MB"
+    return text
+
+
+def compare(report, baseline):
+    # prints the change of the wall times against the baseline report
+    print(f"\nCompared to {baseline.get('commit')}:")
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if old and 'wall' in old and 'wall' in result:
+            print(f"{name}: {old['wall'] * 1000:.2f} ms -> {result['wall'] * 1000:.2f} ms "
+                  f"({result['wall'] / old['wall']:.2f}x)")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmarks the solver, move generation and rendering.')
+    parser.add_argument('names', nargs='*', default=list(BENCHMARKS), help='benchmarks to run. default: all')
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    parser.add_argument('--compare', help='results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.names)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,204 @@
+"""
+    Compact integer encoding of the board, used by the solvers.
+
+    A state is a single int holding one bitmask per piece shape. Each bitmask
+    marks the cells where the pieces of that shape are anchored (top-left cell).
+    Pieces of the same shape are interchangeable, so boards which only differ by
+    swapping two equally shaped pieces map to the same state.
+"""
+
+from game import BOARD_WIDTH, BOARD_HEIGHT, MOVE_TABLE, POSITIONS, TYPE_NAMES, Position, Piece1x1, Piece1x2, \
+    Piece2x1, Piece2x2, to_cell
+
+WIDTH, HEIGHT = BOARD_WIDTH, BOARD_HEIGHT
+CELLS = WIDTH * HEIGHT
+CELL_MASK = (1 << CELLS) - 1
+
+# Order of the shape masks within a state
+SHAPES = (Piece1x1, Piece1x2, Piece2x1, Piece2x2)
+MAIN_SHAPE = SHAPES.index(Piece2x2)
+# the main piece is solved when anchored here
+GOAL = Position(1, 3)
+GOAL_BIT = 1 << (MAIN_SHAPE * CELLS + GOAL.y * WIDTH + GOAL.x)
+
+
+def shape_of(piece):
+    for shape, piece_class in enumerate(SHAPES):
+        if isinstance(piece, piece_class):
+            return shape
+    raise ValueError(f'Unknown piece {piece!r}')
+
+
+# FOOTPRINTS[shape][cell] - mask of the cells covered by a piece anchored at cell, None if it does not fit
+FOOTPRINTS = tuple(MOVE_TABLE.footprints[piece_class.WIDTH, piece_class.HEIGHT] for piece_class in SHAPES)
+
+# MOVES[shape][cell] - maps the mask of empty cells to the toggles of the legal moves
+# of a piece anchored at cell, a toggle flips the piece to its destination within a state.
+MOVES = tuple(
+    tuple(
+        {empty: tuple(((1 << cell) | (1 << destination)) << (shape * CELLS) for destination, _ in moves)
+         for empty, moves in index.items()}
+        for cell, index in enumerate(MOVE_TABLE.table[piece_class.WIDTH, piece_class.HEIGHT])
+    )
+    for shape, piece_class in enumerate(SHAPES)
+)
+
+
+def _mirror_rows(rows, width):
+    # mirrors every row of WIDTH bits in rows, for the anchors of pieces of the given width
+    mirrored = 0
+    for row in range(HEIGHT):
+        for x in range(WIDTH - width + 1):
+            if rows >> (row * WIDTH + x) & 1:
+                mirrored |= 1 << (row * WIDTH + WIDTH - width - x)
+    return mirrored
+
+
+# MIRROR[shape] - mirrors three rows of anchors of the shape at once
+MIRROR = tuple(tuple(_mirror_rows(rows, piece_class.WIDTH) for rows in range(1 << (3 * WIDTH)))
+               for piece_class in SHAPES)
+ROWS_MASK = (1 << (3 * WIDTH)) - 1
+
+
+def mirror(state):
+    # mirror image of the state about the vertical axis
+    mirrored = 0
+    for shape, table in enumerate(MIRROR):
+        mask = (state >> (shape * CELLS)) & CELL_MASK
+        mirrored |= (table[mask & ROWS_MASK] | table[mask >> (3 * WIDTH)] << (3 * WIDTH)) << (shape * CELLS)
+    return mirrored
+
+
+def canonical(state):
+    # The goal is symmetric about the vertical axis, so a board and its mirror image
+    # are equally far from it. Both are represented by the smaller of the two states.
+    return min(state, mirror(state))
+
+
+def encode(board):
+    # board is a game.Board, returns the corresponding state
+    state = 0
+    for piece in board.pieces:
+        shape = shape_of(piece)
+        if shape == MAIN_SHAPE and piece is not board.main_piece:
+            raise ValueError('The main piece must be the only 2x2 piece on the board')
+        state |= 1 << (shape * CELLS + to_cell(piece.position))
+    return state
+
+
+def shape_counts(state):
+    # number of pieces of each shape
+    return tuple(bin(mask).count('1') for mask in shape_masks(state))
+
+
+def placements(counts, state=0):
+    # Yields every legal state adding counts[shape] pieces of each shape to the pieces in state.
+    # Cells are filled in order, so the first free cell is either left empty or anchors a piece.
+    _occupied = occupied(state)
+    area = sum(count * piece_class.WIDTH * piece_class.HEIGHT for count, piece_class in zip(counts, SHAPES))
+    empties = CELLS - bin(_occupied).count('1') - area
+    if empties < 0:
+        return
+    yield from _place(list(counts), state, _occupied, empties, 0)
+
+
+def _place(counts, state, _occupied, empties, cell):
+    while cell < CELLS and _occupied >> cell & 1:
+        cell += 1
+    if cell == CELLS:
+        yield state
+        return
+    if empties:
+        yield from _place(counts, state, _occupied | 1 << cell, empties - 1, cell + 1)
+    for shape, piece_class in enumerate(SHAPES):
+        _footprint = FOOTPRINTS[shape][cell]
+        if counts[shape] and _footprint is not None and not _footprint & _occupied:
+            counts[shape] -= 1
+            yield from _place(counts, state | 1 << (shape * CELLS + cell), _occupied | _footprint, empties, cell + 1)
+            counts[shape] += 1
+
+
+def goal_states(state):
+    # every solved state with the same pieces as state
+    counts = list(shape_counts(state))
+    counts[MAIN_SHAPE] -= 1
+    return placements(counts, GOAL_BIT)
+
+
+def shape_masks(state):
+    return tuple((state >> (shape * CELLS)) & CELL_MASK for shape in range(len(SHAPES)))
+
+
+def layout_of(state):
+    # the layout of the state, as taken by Board.from_layout
+    layout = []
+    for piece_class, mask in zip(SHAPES, shape_masks(state)):
+        for cell in range(CELLS):
+            if mask >> cell & 1:
+                layout.append((TYPE_NAMES[piece_class], *POSITIONS[cell]))
+    return layout
+
+
+def occupied(state):
+    # mask of the cells covered by any piece
+    m1x1, m1x2, m2x1, m2x2 = shape_masks(state)
+    return (m1x1 | m1x2 | m1x2 << WIDTH | m2x1 | m2x1 << 1 |
+            m2x2 | m2x2 << 1 | m2x2 << WIDTH | m2x2 << (WIDTH + 1))
+
+
+def is_solved(state):
+    return bool(state & GOAL_BIT)
+
+
+def successors(state):
+    # yields every state reachable with a single move
+    empty = ~occupied(state) & CELL_MASK
+    for shape, moves in enumerate(MOVES):
+        mask = (state >> (shape * CELLS)) & CELL_MASK
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            for toggle in moves[bit.bit_length() - 1].get(empty, ()):
+                yield state ^ toggle
+
+
+def canonical_successors(state):
+    # successors of the state, folded with their mirror images
+    for new_state in successors(state):
+        yield min(new_state, mirror(new_state))
+
+
+def unfold(path, state):
+    # Maps a path of canonical states to the real path starting at state,
+    # the canonical form of state must be the first element of path.
+    real_path = [state]
+    for canonical_state in path[1:]:
+        if canonical_state not in set(successors(state)):
+            canonical_state = mirror(canonical_state)
+        state = canonical_state
+        real_path.append(state)
+    return real_path
+
+
+def decode_move(state, new_state):
+    # returns (shape, source cell, destination cell) of the move between the states
+    diff = state ^ new_state
+    shape = (diff.bit_length() - 1) // CELLS
+    offset = shape * CELLS
+    source = (state & diff) >> offset
+    destination = (new_state & diff) >> offset
+    return shape, source.bit_length() - 1, destination.bit_length() - 1
+
+
+def path_to_moves(path, board):
+    # Maps a path of states starting at board's state to a list of (piece, position),
+    # where piece belongs to board. Interchangeable pieces are told apart by tracking
+    # which piece of the board sits on each cell along the way.
+    pieces = {to_cell(piece.position): piece for piece in board.pieces}
+    moves = []
+    for state, new_state in zip(path, path[1:]):
+        _, source, destination = decode_move(state, new_state)
+        piece = pieces.pop(source)
+        pieces[destination] = piece
+        moves.append((piece, POSITIONS[destination]))
+    return moves
@@ -0,0 +1,82 @@
+"""
+    Cache of solved paths, so that a position on a path solved before is answered instantly.
+
+    Every state of a path is stored with its distance from the goal and the state after it,
+    keyed by the canonical state (see bitboard.canonical). A suffix of a shortest path is
+    itself a shortest path, so the moves stored are optimal as well.
+"""
+import shelve
+from collections import OrderedDict
+
+from bitboard import canonical, mirror
+
+# states kept in memory, the least recently used are evicted first
+CAPACITY = 100000
+
+
+class SolutionCache:
+    """
+        LRU cache of the optimal next state, in memory and optionally on disk.
+        The on-disk store keeps every state added, across sessions.
+    """
+
+    def __init__(self, capacity=CAPACITY, path=None):
+        self.capacity = capacity
+        # canonical state to (distance, next state), next state is None for solved states
+        # and is oriented as the canonical state
+        self.entries = OrderedDict()
+        self.store = shelve.open(path) if path is not None else None
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.store is not None:
+            entry = self.store.get(str(key))
+            if entry is not None:
+                self._put(key, entry, store=False)
+        return entry
+
+    def _put(self, key, entry, store=True):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        if store and self.store is not None:
+            self.store[str(key)] = entry
+
+    def add_path(self, path):
+        # path is a shortest path of states to the goal
+        for index, state in enumerate(path):
+            next_state = path[index + 1] if index + 1 < len(path) else None
+            key = canonical(state)
+            if key != state and next_state is not None:
+                next_state = mirror(next_state)
+            self._put(key, (len(path) - 1 - index, next_state))
+
+    def lookup(self, state):
+        # (distance, next state) of the state, None if not cached
+        key = canonical(state)
+        entry = self._get(key)
+        if entry is None:
+            return None
+        distance, next_state = entry
+        if key != state and next_state is not None:
+            next_state = mirror(next_state)
+        return distance, next_state
+
+    def solve(self, state):
+        # shortest path of states to the goal, None unless every state on it is cached
+        path = [state]
+        while True:
+            entry = self.lookup(path[-1])
+            if entry is None:
+                return None
+            if entry[1] is None:
+                return path
+            path.append(entry[1])
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
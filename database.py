@@ -0,0 +1,137 @@
+"""
+    Perfect-play distance table for every board reachable from the start position.
+
+    Build it offline with
+
+        python database.py
+
+    The table is an open addressing hash table on disk, mapping each canonical state (see bitboard)
+    to its exact distance from the nearest solved state. It is memory-mapped at load time,
+    so the optimal next move from any position is a handful of O(1) lookups.
+"""
+import mmap
+import os
+import struct
+
+import graph
+from bitboard import CELLS, SHAPES, canonical, encode, is_solved, successors, \
+    path_to_moves
+from game import Board as _Board
+from solver import explore_states
+
+DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'distances.bin')
+
+MAGIC = b'KLOTSKI1'
+# magic, number of slots
+HEADER = struct.Struct('<8sI')
+KEY_SIZE = (CELLS * len(SHAPES) + 7) // 8
+# each slot holds the state followed by its distance, an all zero key marks an empty slot
+SLOT_SIZE = KEY_SIZE + 1
+MULTIPLIER = 0x9E3779B97F4A7C15
+# distance of the states not reached, while building
+UNKNOWN = graph.UNREACHED
+
+
+def _slot(state, slots):
+    # slots is a power of two
+    return (state * MULTIPLIER >> 64) & (slots - 1)
+
+
+def retrograde_distances(ranking, visited):
+    # BFS backwards from all the solved states, moves are reversible so the
+    # predecessors of a state are its successors. visited marks the canonical states by rank,
+    # as returned by explore_states.
+    # Returns the ranking of the states, and their distances indexed by rank (UNKNOWN if unreachable).
+    solved = (index for index, _visited in enumerate(visited) if _visited and is_solved(ranking.unrank(index)))
+    return ranking, graph.distances(ranking.size, graph.canonical_neighbours(ranking), solved)
+
+
+def build(path=DATABASE_FILE):
+    ranking, distances = retrograde_distances(*explore_states())
+    known = [index for index, distance in enumerate(distances) if distance != UNKNOWN]
+    assert max(distances[index] for index in known) < UNKNOWN
+
+    # keep the load factor under half
+    slots = 1
+    while slots < 2 * len(known):
+        slots *= 2
+
+    table = bytearray(slots * SLOT_SIZE)
+    for index in known:
+        state = ranking.unrank(index)
+        slot = _slot(state, slots)
+        while any(table[slot * SLOT_SIZE: slot * SLOT_SIZE + KEY_SIZE]):
+            # linear probing
+            slot = (slot + 1) & (slots - 1)
+        table[slot * SLOT_SIZE: (slot + 1) * SLOT_SIZE] = state.to_bytes(KEY_SIZE, 'little') + bytes([distances[index]])
+
+    # written next to the table and moved into place, so that a partial table is never loaded
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, slots))
+        f.write(table)
+    os.replace(path + '.tmp', path)
+    print(f"Saved the distances of {len(known)} boards to {path}.")
+
+
+class DistanceTable:
+    """
+        Read-only view of the table built by build()
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slots = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a distance table')
+
+    @classmethod
+    def load(cls, path=DATABASE_FILE):
+        # returns None when the table has not been built yet
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def distance(self, state):
+        # distance of the state from the goal, None for unknown states
+        state = canonical(state)
+        key = state.to_bytes(KEY_SIZE, 'little')
+        slot = _slot(state, self.slots)
+        while True:
+            offset = HEADER.size + slot * SLOT_SIZE
+            _key = self.data[offset: offset + KEY_SIZE]
+            if _key == key:
+                return self.data[offset + KEY_SIZE]
+            if not any(_key):
+                return None
+            slot = (slot + 1) & (self.slots - 1)
+
+    def next_state(self, state):
+        # the state after the optimal next move
+        distance = self.distance(state)
+        if not distance:
+            return None
+        for new_state in successors(state):
+            if self.distance(new_state) == distance - 1:
+                return new_state
+
+    def solve(self, state):
+        # optimal path of states to the goal, None for unknown states
+        if self.distance(state) is None:
+            return None
+        path = [state]
+        while not is_solved(state):
+            state = self.next_state(state)
+            path.append(state)
+        return path
+
+    def solver(self, _board: _Board):
+        # drop-in replacement for bfs_solver, None if the board is not in the table
+        path = self.solve(encode(_board))
+        if path is None:
+            return None
+        return path_to_moves(path, _board)
+
+
+if __name__ == '__main__':
+    build()
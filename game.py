@@ -1,13 +1,26 @@
 from collections import namedtuple
 
-from utilities import draw_piece
+from movetable import get_move_table
 
 Position = namedtuple('Position', ['x', 'y'])
 
+BOARD_WIDTH, BOARD_HEIGHT = 4, 5
+# Shared by the UI and the solver, built once for the board geometry
+MOVE_TABLE = get_move_table(BOARD_WIDTH, BOARD_HEIGHT)
+# cell number to position
+POSITIONS = tuple(Position(cell % BOARD_WIDTH, cell // BOARD_WIDTH) for cell in range(BOARD_WIDTH * BOARD_HEIGHT))
 
-def is_neighbour(_pos1: Position, _pos2: Position):
-    # Manhattan distance is 1 then neighbour
-    return abs(_pos1.x - _pos2.x) + abs(_pos1.y - _pos2.y) == 1
+
+def to_cell(position):
+    return position.y * BOARD_WIDTH + position.x
+
+
+def _cells(mask):
+    # cells of the mask, lowest first
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        yield bit.bit_length() - 1
 
 
 class Piece:
@@ -23,15 +36,27 @@ class Piece:
         # returns the positions the piece occupies
         raise NotImplemented
 
+    @property
+    def footprint(self):
+        # mask of the cells the piece occupies
+        return MOVE_TABLE.footprints[self.WIDTH, self.HEIGHT][to_cell(self.position)]
+
     def update_position(self, position):
         # Could be used later for tracking ??
         self.position = position
 
+    def _moves(self, empty_positions):
+        # (destination, click) pairs from the move table
+        empty = 0
+        for empty_position in empty_positions:
+            empty |= 1 << to_cell(empty_position)
+        return MOVE_TABLE.lookup((self.WIDTH, self.HEIGHT), to_cell(self.position), empty)
+
     def possible_moves(self, empty_positions):
         # returns all positions the piece can move to.
         # empty_positions - set of empty positions
         # NOTE: USED BY SOLVER
-        raise NotImplemented
+        return [POSITIONS[destination] for destination, _ in self._moves(empty_positions)]
 
     def possible_moves_ui(self, empty_positions):
         # same as above, however takes UI into consideration
@@ -39,9 +64,16 @@ class Piece:
         #  - first element is the list of all positions the piece can move
         #  - second element is a list corresponding to click positions
         #     which should result in new positions specified in the first element
-        raise NotImplemented
+        new_positions = []
+        click_positions = []
+        for destination, click in self._moves(empty_positions):
+            new_positions.append(POSITIONS[destination])
+            click_positions.append({position for position in empty_positions if click >> to_cell(position) & 1})
+        return new_positions, click_positions
 
     def draw(self, surf, size):
+        # imported here, so that the model can be used without pygame
+        from utilities import draw_piece
         draw_piece(surf, self.COLOR, self.position.x * size, self.position.y * size, self.WIDTH * size,
                    self.HEIGHT * size, size)
 
@@ -54,36 +86,6 @@ class Piece1x1(Piece):
     def positions(self):
         yield self.position
 
-    def possible_moves_ui(self, empty_positions):
-        if is_neighbour(*empty_positions):
-            # if empty positions are neighbouring each other and piece is neighbouring one of these positions
-            # the piece can go to any of the empty positions
-            if any(is_neighbour(self.position, empty_position) for empty_position in empty_positions):
-                return list(empty_positions), [{empty_position} for empty_position in empty_positions]
-
-        new_positions = []
-        click_positions = []
-        for empty_position in empty_positions:
-            # if empty position is a neighbour of piece,
-            # then it's possible position to move to
-            if is_neighbour(self.position, empty_position):
-                new_positions.append(empty_position)
-                click_positions.append({empty_position})
-
-        # positions where the UI is clicked is the same as new resultant positions
-        return new_positions, click_positions
-
-    def possible_moves(self, empty_positions):
-        if is_neighbour(*empty_positions):
-            # if piece neighbours an empty position and empty positions themselves neighbour each other,
-            # piece can move to any of the positions
-            if any(is_neighbour(self.position, empty_position) for empty_position in empty_positions):
-                return list(empty_positions)
-            return []
-
-        # if empty position is a neighbour, piece can move there.
-        return [empty_position for empty_position in empty_positions if is_neighbour(self.position, empty_position)]
-
 
 class Piece1x2(Piece):
     WIDTH = 1
@@ -94,59 +96,6 @@ class Piece1x2(Piece):
         yield self.position
         yield Position(self.position.x, self.position.y + 1)
 
-    def possible_moves_ui(self, empty_positions):
-        new_positions = []
-        click_positions = []
-        x, y = self.position
-        if Position(x, y - 1) in empty_positions:
-            # if movement possible towards top
-            new_positions.append(Position(x, y - 1))
-            click_positions.append({Position(x, y - 1)})
-
-            if Position(x, y - 2) in empty_positions:
-                new_positions.append(Position(x, y - 2))
-                click_positions.append({Position(x, y - 2)})
-
-        if Position(x, y + 2) in empty_positions:
-            # if movement possible towards bottom
-            new_positions.append(Position(x, y + 1))
-            click_positions.append({Position(x, y + 2)})
-
-            if Position(x, y + 3) in empty_positions:
-                new_positions.append(Position(x, y + 2))
-                click_positions.append({Position(x, y + 3)})
-
-        if {Position(x - 1, y), Position(x - 1, y + 1)} == empty_positions:
-            # if movement possible towards left
-            new_positions.append(Position(x - 1, y))
-            click_positions.append(empty_positions)
-
-        if {Position(x + 1, y), Position(x + 1, y + 1)} == empty_positions:
-            # if movement possible towards right
-            new_positions.append(Position(x + 1, y))
-            click_positions.append(empty_positions)
-
-        return new_positions, click_positions
-
-    def possible_moves(self, empty_positions):
-        new_positions = []
-        x, y = self.position
-        if Position(x, y - 1) in empty_positions:
-            new_positions.append(Position(x, y - 1))
-            if Position(x, y - 2) in empty_positions:
-                new_positions.append(Position(x, y - 2))
-        if Position(x, y + 2) in empty_positions:
-            new_positions.append(Position(x, y + 1))
-            if Position(x, y + 3) in empty_positions:
-                new_positions.append(Position(x, y + 2))
-
-        if {Position(x - 1, y), Position(x - 1, y + 1)} == empty_positions:
-            new_positions.append(Position(x - 1, y))
-        if {Position(x + 1, y), Position(x + 1, y + 1)} == empty_positions:
-            new_positions.append(Position(x + 1, y))
-
-        return new_positions
-
 
 class Piece2x1(Piece):
     WIDTH = 2
@@ -157,59 +106,6 @@ class Piece2x1(Piece):
         yield self.position
         yield Position(self.position.x + 1, self.position.y)
 
-    def possible_moves_ui(self, empty_positions):
-        new_positions = []
-        click_positions = []
-        x, y = self.position
-        if Position(x - 1, y) in empty_positions:
-            # if movement possible towards left
-            new_positions.append(Position(x - 1, y))
-            click_positions.append({Position(x - 1, y)})
-
-            if Position(x - 2, y) in empty_positions:
-                new_positions.append(Position(x - 2, y))
-                click_positions.append({Position(x - 2, y)})
-
-        if Position(x + 2, y) in empty_positions:
-            # if movement possible towards right
-            new_positions.append(Position(x + 1, y))
-            click_positions.append({Position(x + 2, y)})
-
-            if Position(x + 3, y) in empty_positions:
-                new_positions.append(Position(x + 2, y))
-                click_positions.append({Position(x + 3, y)})
-
-        if {Position(x, y - 1), Position(x + 1, y - 1)} == empty_positions:
-            # if movement possible towards top
-            new_positions.append(Position(x, y - 1))
-            click_positions.append(empty_positions)
-
-        if {Position(x, y + 1), Position(x + 1, y + 1)} == empty_positions:
-            # if movement possible towards bottom
-            new_positions.append(Position(x, y + 1))
-            click_positions.append(empty_positions)
-
-        return new_positions, click_positions
-
-    def possible_moves(self, empty_positions):
-        new_positions = []
-        x, y = self.position
-        if Position(x - 1, y) in empty_positions:
-            new_positions.append(Position(x - 1, y))
-            if Position(x - 2, y) in empty_positions:
-                new_positions.append(Position(x - 2, y))
-        if Position(x + 2, y) in empty_positions:
-            new_positions.append(Position(x + 1, y))
-            if Position(x + 3, y) in empty_positions:
-                new_positions.append(Position(x + 2, y))
-
-        if {Position(x, y - 1), Position(x + 1, y - 1)} == empty_positions:
-            new_positions.append(Position(x, y - 1))
-        if {Position(x, y + 1), Position(x + 1, y + 1)} == empty_positions:
-            new_positions.append(Position(x, y + 1))
-
-        return new_positions
-
 
 class Piece2x2(Piece):
     COLOR = (119, 17, 0)
@@ -223,45 +119,14 @@ class Piece2x2(Piece):
         yield Position(self.position.x, self.position.y + 1)
         yield Position(self.position.x + 1, self.position.y + 1)
 
-    def possible_moves_ui(self, empty_positions):
-        new_positions = []
-        click_positions = []
-        x, y = self.position
-        if {Position(x, y - 1), Position(x + 1, y - 1)} == empty_positions:
-            # if movement possible towards top
-            new_positions.append(Position(x, y - 1))
-            click_positions.append(empty_positions)
-
-        if {Position(x, y + 2), Position(x + 1, y + 2)} == empty_positions:
-            # if movement possible towards bottom
-            new_positions.append(Position(x, y + 1))
-            click_positions.append(empty_positions)
-
-        if {Position(x - 1, y), Position(x - 1, y + 1)} == empty_positions:
-            # if movement possible towards left
-            new_positions.append(Position(x - 1, y))
-            click_positions.append(empty_positions)
-
-        if {Position(x + 2, y), Position(x + 2, y + 1)} == empty_positions:
-            # if movement possible towards right
-            new_positions.append(Position(x + 1, y))
-            click_positions.append(empty_positions)
 
-        return new_positions, click_positions
+# Steps between the snapshots of the board kept in the history
+SNAPSHOT_INTERVAL = 32
 
-    def possible_moves(self, empty_positions):
-        new_positions = []
-        x, y = self.position
-        if {Position(x, y - 1), Position(x + 1, y - 1)} == empty_positions:
-            new_positions.append(Position(x, y - 1))
-        if {Position(x, y + 2), Position(x + 1, y + 2)} == empty_positions:
-            new_positions.append(Position(x, y + 1))
-        if {Position(x - 1, y), Position(x - 1, y + 1)} == empty_positions:
-            new_positions.append(Position(x - 1, y))
-        if {Position(x + 2, y), Position(x + 2, y + 1)} == empty_positions:
-            new_positions.append(Position(x + 1, y))
-
-        return new_positions
+# Pieces by name, as used in layouts
+PIECE_TYPES = {'1x1': Piece1x1, '1x2': Piece1x2, '2x1': Piece2x1, '2x2': Piece2x2}
+# name of each piece type, inverse of PIECE_TYPES
+TYPE_NAMES = {piece_type: name for name, piece_type in PIECE_TYPES.items()}
 
 
 class Board:
@@ -271,8 +136,34 @@ class Board:
         assert isinstance(pieces[-1], Piece2x2)
         self.pieces = pieces
         self.main_piece = pieces[-1]
+        # history of (piece, old position, new position), the steps before history_insert are taken
         self.history = []
         self.history_insert = 0
+        # the cells of the pieces every SNAPSHOT_INTERVAL steps of the history, for seek
+        self.snapshots = []
+
+        # Occupancy grid, the piece covering each cell (None if empty),
+        # kept up to date as pieces move, along with the mask of the empty cells.
+        self._build_grid()
+        assert len(self._empty_positions) == 2
+        self.snapshots.append(self._snapshot())
+
+    def _build_grid(self):
+        self.grid = [None] * len(POSITIONS)
+        for piece in self.pieces:
+            for cell in _cells(piece.footprint):
+                self.grid[cell] = piece
+        self.empty = sum(1 << cell for cell, piece in enumerate(self.grid) if piece is None)
+        self._empty_positions = frozenset(POSITIONS[cell] for cell in _cells(self.empty))
+
+    def _snapshot(self):
+        # compact copy of the positions of the pieces
+        return bytes(to_cell(piece.position) for piece in self.pieces)
+
+    def _restore(self, snapshot):
+        for piece, cell in zip(self.pieces, snapshot):
+            piece.update_position(POSITIONS[cell])
+        self._build_grid()
 
     @property
     def number_of_steps(self):
@@ -284,16 +175,50 @@ class Board:
                     Piece1x2(0, 0), Piece1x2(0, 2), Piece1x2(3, 0), Piece1x2(3, 2),
                     Piece2x1(1, 2), Piece2x2(1, 0)])
 
+    @classmethod
+    def from_layout(cls, layout):
+        # layout is a list of (name, x, y), see PIECE_TYPES for the names.
+        # The 2x2 piece is the main piece, it need not be the last one.
+        if any(not isinstance(x, int) or not isinstance(y, int) for _, x, y in layout):
+            raise ValueError('Positions of the layout must be integers')
+        pieces = [PIECE_TYPES[name](x, y) for name, x, y in layout]
+        pieces.sort(key=lambda piece: isinstance(piece, Piece2x2))
+
+        # pieces must fit on the board without overlapping, and leave two empty positions
+        occupied = 0
+        for piece in pieces:
+            x, y = piece.position
+            footprint = piece.footprint if 0 <= x < BOARD_WIDTH and 0 <= y < BOARD_HEIGHT else None
+            if footprint is None or footprint & occupied:
+                raise ValueError(f'{type(piece).__name__} at ({x}, {y}) does not fit in the layout')
+            occupied |= footprint
+        if bin(occupied).count('1') != len(POSITIONS) - 2:
+            raise ValueError('Layout must leave two empty positions')
+        if sum(isinstance(piece, Piece2x2) for piece in pieces) != 1:
+            raise ValueError('Layout must have exactly one 2x2 piece')
+        return cls(pieces)
+
+    @property
+    def layout(self):
+        # inverse of from_layout
+        return [(TYPE_NAMES[type(piece)], piece.position.x, piece.position.y) for piece in self.pieces]
+
     def empty_positions(self):
-        # positions: initial store all positions on the board
-        positions = {Position(x, y) for x in range(4) for y in range(5)}
-        for piece in self.pieces:
-            for occupied_position in piece.positions:
-                # remove positions occupied by each of the pieces
-                positions.remove(occupied_position)
-        assert len(positions) == 2
-        # positions with no piece are empty
-        return positions
+        # the two positions with no piece
+        return self._empty_positions
+
+    def _place(self, piece, position):
+        # moves the piece to position, updating the grid
+        footprint = piece.footprint
+        piece.update_position(position)
+        new_footprint = piece.footprint
+        for cell in _cells(footprint & ~new_footprint):
+            self.grid[cell] = None
+        for cell in _cells(new_footprint & ~footprint):
+            self.grid[cell] = piece
+        # the cells left become empty, the cells entered are no longer empty
+        self.empty ^= footprint ^ new_footprint
+        self._empty_positions = frozenset(POSITIONS[cell] for cell in _cells(self.empty))
 
     @property
     def is_solved(self):
@@ -302,9 +227,8 @@ class Board:
 
     def get_piece(self, position):
         # Gets the piece in the specified position
-        for piece in self.pieces:
-            if position in piece.positions:
-                return piece
+        if 0 <= position.x < BOARD_WIDTH and 0 <= position.y < BOARD_HEIGHT:
+            return self.grid[to_cell(position)]
         return None
 
     def draw(self, surf, size):
@@ -334,24 +258,42 @@ class Board:
     def move(self, piece, position):
         # position is the new start position of the piece
         assert self._can_move(piece, position)
-        # insert into history the previous position
-        self.history = self.history[:self.history_insert]
-        self.history.append((piece, piece.position))
+        self._move(piece, position)
+
+    def _move(self, piece, position):
+        # moves without checking that the move is legal, for moves known to be.
+        # The steps undone are dropped, along with their snapshots.
+        del self.history[self.history_insert:]
+        del self.snapshots[self.history_insert // SNAPSHOT_INTERVAL + 1:]
+        self.history.append((piece, piece.position, position))
         self.history_insert += 1
-        piece.update_position(position)
+        self._place(piece, position)
+        if not self.history_insert % SNAPSHOT_INTERVAL:
+            self.snapshots.append(self._snapshot())
 
-    # The history functions manipulate the history stack to
+    # The history functions move along the history to
     # support undo and redo of steps.
     def history_back(self):
-        if self.history[:self.history_insert]:
+        if self.history_insert:
             self.history_insert -= 1
-            piece, position = self.history[self.history_insert]
-            self.history[self.history_insert] = (piece, piece.position)
-            piece.update_position(position)
+            piece, position, _ = self.history[self.history_insert]
+            self._place(piece, position)
 
     def history_forward(self):
         if self.history_insert < len(self.history):
-            piece, position = self.history[self.history_insert]
-            self.history[self.history_insert] = (piece, piece.position)
+            piece, _, position = self.history[self.history_insert]
             self.history_insert += 1
-            piece.update_position(position)
+            self._place(piece, position)
+
+    def seek(self, step):
+        # Jumps to the step of the history, restoring the nearest snapshot
+        # when it is closer than the current step, and replaying the steps from there.
+        step = max(0, min(step, len(self.history)))
+        snapshot = min(round(step / SNAPSHOT_INTERVAL), len(self.snapshots) - 1)
+        if abs(step - snapshot * SNAPSHOT_INTERVAL) < abs(step - self.history_insert):
+            self._restore(self.snapshots[snapshot])
+            self.history_insert = snapshot * SNAPSHOT_INTERVAL
+        while self.history_insert < step:
+            self.history_forward()
+        while self.history_insert > step:
+            self.history_back()
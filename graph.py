@@ -0,0 +1,65 @@
+"""
+    Searches over the placements of a set of pieces, indexed by rank (see ranking).
+
+    The graph is given by neighbours(index), the ranks of the placements one move away from
+    the placement ranked index. Moves are reversible, so the graph is undirected.
+    What the searches mark is held in arrays indexed by rank, rather than in sets of states.
+"""
+from array import array
+
+from bitboard import canonical_successors
+
+# distance of the placements not reached
+UNREACHED = 255
+
+
+def canonical_neighbours(ranking):
+    # neighbours of the canonical states (see bitboard.canonical) of the ranking
+    def neighbours(index):
+        return [ranking.rank(state) for state in canonical_successors(ranking.unrank(index))]
+    return neighbours
+
+
+def components(size, neighbours, seeds=None):
+    # Labels the connected components holding the seeds, every placement by default.
+    # Returns the label of every placement (-1 if in none of them) and the size of every component.
+    labels = array('i', [-1]) * size
+    sizes = []
+    for seed in range(size) if seeds is None else seeds:
+        if labels[seed] >= 0:
+            continue
+        label = len(sizes)
+        labels[seed] = label
+        stack = [seed]
+        count = 0
+        while stack:
+            index = stack.pop()
+            count += 1
+            for target in neighbours(index):
+                if labels[target] < 0:
+                    labels[target] = label
+                    stack.append(target)
+        sizes.append(count)
+    return labels, sizes
+
+
+def distances(size, neighbours, sources):
+    # BFS from all the sources at once, returns the distance of every placement
+    # to its nearest source as a bytearray (UNREACHED if there is none)
+    result = bytearray([UNREACHED]) * size
+    frontier = list(sources)
+    for index in frontier:
+        result[index] = 0
+    distance = 0
+    while frontier:
+        distance += 1
+        new_frontier = []
+        for index in frontier:
+            for target in neighbours(index):
+                if result[target] == UNREACHED:
+                    result[target] = distance
+                    new_frontier.append(target)
+        if new_frontier and distance >= UNREACHED:
+            raise ValueError('Distances do not fit in a byte')
+        frontier = new_frontier
+    return result
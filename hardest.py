@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+    Finds the hardest layouts of a set of pieces, by retrograde analysis of every placement.
+
+        ./hardest.py --top 10 --output hardest.jsonl
+
+    Every legal placement of the pieces (see ranking) is expanded once, spread over a pool of
+    processes, into a graph of the moves between placements indexed by rank. The graph is split
+    into its connected components, and a BFS from all the solved placements at once gives the
+    distance of every placement to its nearest solved one. The placements furthest from a solution
+    in each component are its hardest layouts.
+
+    The layouts are written one per line as JSON, as read by batch.py and render.py.
+    Memory stays bounded by a few bytes per placement and per move, all held in arrays.
+"""
+import json
+import sys
+from argparse import ArgumentParser, FileType
+from array import array
+from multiprocessing import Pool
+
+import graph
+from bitboard import encode, is_solved, layout_of, mirror, shape_counts, successors
+from game import PIECE_TYPES, Board
+from ranking import get_ranking
+
+# placements expanded by a worker at a time
+CHUNK_SIZE = 4096
+
+
+def _expand(task):
+    # Runs in the worker processes, expands the placements ranked start .. end - 1.
+    # Returns the number of moves of each placement, whether each is solved,
+    # and the ranks the moves lead to.
+    counts, start, end = task
+    ranking = get_ranking(counts)
+    degrees = bytearray(end - start)
+    solved = bytearray(end - start)
+    targets = array('I')
+    for index in range(start, end):
+        state = ranking.unrank(index)
+        solved[index - start] = is_solved(state)
+        before = len(targets)
+        targets.extend(ranking.rank(new_state) for new_state in successors(state))
+        degrees[index - start] = len(targets) - before
+    return degrees, solved, targets
+
+
+def move_graph(counts, processes=None):
+    # The moves between the placements as a graph in compressed form,
+    # the moves of the placement ranked i lead to targets[offsets[i]: offsets[i + 1]].
+    # Also returns whether each placement is solved.
+    size = get_ranking(counts).size
+    offsets = array('I', [0])
+    targets = array('I')
+    solved = bytearray()
+    tasks = ((counts, start, min(start + CHUNK_SIZE, size)) for start in range(0, size, CHUNK_SIZE))
+    with Pool(processes) as pool:
+        # in order, so the chunks line up
+        for degrees, _solved, _targets in pool.imap(_expand, tasks):
+            total = offsets[-1]
+            for degree in degrees:
+                total += degree
+                offsets.append(total)
+            targets.extend(_targets)
+            solved.extend(_solved)
+    return offsets, targets, solved
+
+
+def neighbours_of(offsets, targets):
+    # neighbours of the placements in the move graph, see graph
+    def neighbours(index):
+        return targets[offsets[index]: offsets[index + 1]]
+    return neighbours
+
+
+def hardest_layouts(counts, top=10, processes=None):
+    # Returns the hardest placement of each solvable component, hardest first,
+    # as dicts of the layout, its optimal number of moves and the size of its component.
+    # A component and its mirror image have the same hardest layouts, only one of them is kept.
+    counts = tuple(counts)
+    ranking = get_ranking(counts)
+    offsets, targets, solved = move_graph(counts, processes)
+    neighbours = neighbours_of(offsets, targets)
+    labels, sizes = graph.components(ranking.size, neighbours)
+    # moves are reversible, so this is the distance of every placement to its nearest solved one
+    solved_indices = (index for index, _solved in enumerate(solved) if _solved)
+    distances = graph.distances(ranking.size, neighbours, solved_indices)
+
+    # the first placement furthest from a solution in each component
+    hardest = {}
+    for index, distance in enumerate(distances):
+        if distance != graph.UNREACHED and distance > hardest.get(labels[index], (-1,))[0]:
+            hardest[labels[index]] = distance, index
+
+    results = []
+    for label, (distance, index) in hardest.items():
+        state = ranking.unrank(index)
+        if labels[ranking.rank(mirror(state))] < label:
+            continue
+        results.append({'id': index, 'layout': layout_of(state), 'length': distance, 'component_size': sizes[label]})
+    results.sort(key=lambda result: (-result['length'], -result['component_size']))
+
+    solvable = sum(1 for label in range(len(sizes)) if label in hardest)
+    print(f"{ranking.size} placements in {len(sizes)} components, of which {solvable} can be solved.",
+          file=sys.stderr)
+    return results[:top]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Finds the klotski layouts with the longest optimal solutions.')
+    parser.add_argument('--counts', type=int, nargs=len(PIECE_TYPES), metavar='N',
+                        help=f"number of pieces of each shape ({', '.join(PIECE_TYPES)}). "
+                             f"default: those of the start position")
+    parser.add_argument('--top', type=int, default=10, help='number of layouts to output. default: 10')
+    parser.add_argument('--output', type=FileType('w'), default=sys.stdout, help='file for the layouts. default: stdout')
+    parser.add_argument('--processes', type=int, default=None, help='number of workers. default: number of cores')
+    args = parser.parse_args()
+
+    piece_counts = args.counts
+    if piece_counts is None:
+        piece_counts = list(shape_counts(encode(Board.from_start_position())))
+    if piece_counts[-1] != 1:
+        parser.error('There must be exactly one 2x2 piece')
+
+    for layout in hardest_layouts(piece_counts, args.top, args.processes):
+        args.output.write(json.dumps(layout) + '\n')
@@ -0,0 +1,114 @@
+"""
+    Admissible heuristics for the informed solvers (A*, IDA*)
+"""
+from collections import deque
+from functools import lru_cache
+
+from bitboard import CELLS, CELL_MASK, FOOTPRINTS, GOAL, GOAL_BIT, MAIN_SHAPE, SHAPES, WIDTH, MOVE_TABLE, \
+    placements, shape_counts
+
+# Additive pattern databases as (shapes kept in the pattern, shapes whose moves are counted).
+# Every move is counted by exactly one pattern, so the sum of the distances stays admissible.
+PATTERNS = (
+    ((1, 2, 3), (1, 2, 3)),  # main piece with the 1x2 and 2x1 pieces
+    ((0, 3), (0,)),  # 1x1 pieces around the main piece
+)
+
+
+def manhattan(state):
+    # each move slides the main piece by at most one cell towards the goal
+    cell = ((state >> (MAIN_SHAPE * CELLS)) & CELL_MASK).bit_length() - 1
+    return abs(cell % WIDTH - GOAL.x) + abs(cell // WIDTH - GOAL.y)
+
+
+def _field_mask(shapes):
+    # mask selecting the given shapes within a state
+    mask = 0
+    for shape in shapes:
+        mask |= CELL_MASK << (shape * CELLS)
+    return mask
+
+
+# MOVES[shape][cell] - list of (need, toggle), valid for any number of empty cells
+MOVES = tuple(
+    tuple(
+        [(need, ((1 << cell) | (1 << destination)) << (shape * CELLS)) for need, destination, _ in moves]
+        for cell, moves in enumerate(MOVE_TABLE.moves[piece_class.WIDTH, piece_class.HEIGHT])
+    )
+    for shape, piece_class in enumerate(SHAPES)
+)
+
+
+def _abstract_successors(state, shapes, counted):
+    # yields (cost, new_state) for a board holding only the pieces of the given shapes
+    empty = CELL_MASK
+    for shape in shapes:
+        mask = (state >> (shape * CELLS)) & CELL_MASK
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            empty &= ~FOOTPRINTS[shape][bit.bit_length() - 1]
+
+    for shape in shapes:
+        cost = int(shape in counted)
+        mask = (state >> (shape * CELLS)) & CELL_MASK
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            for need, toggle in MOVES[shape][bit.bit_length() - 1]:
+                if need & empty == need:
+                    yield cost, state ^ toggle
+
+
+@lru_cache(maxsize=None)
+def pattern_database(counts, shapes, counted):
+    # Distances to the goal of every arrangement of the pattern pieces, where only
+    # the moves of the counted shapes cost a step. counts is the number of pieces per shape.
+    # 0-1 BFS backwards from all the goal arrangements, moves are reversible.
+    pattern_counts = [count if shape in shapes else 0 for shape, count in enumerate(counts)]
+    pattern_counts[MAIN_SHAPE] -= 1
+    distances = dict.fromkeys(placements(pattern_counts, GOAL_BIT), 0)
+    new_states = deque(distances)
+    while new_states:
+        state = new_states.popleft()
+        distance = distances[state]
+        for cost, new_state in _abstract_successors(state, shapes, counted):
+            if distance + cost < distances.get(new_state, distance + cost + 1):
+                distances[new_state] = distance + cost
+                if cost:
+                    new_states.append(new_state)
+                else:
+                    new_states.appendleft(new_state)
+    return distances
+
+
+class PatternHeuristic:
+    """
+        Sum of the additive pattern databases for the pieces of a board.
+        The databases are built on first use, and shared between boards with the same pieces.
+    """
+    # returned for boards which can not reach the goal
+    INFINITY = 1 << 16
+
+    def __init__(self, state, patterns=PATTERNS):
+        counts = shape_counts(state)
+        self.databases = [(_field_mask(shapes), pattern_database(counts, shapes, counted))
+                          for shapes, counted in patterns]
+
+    def __call__(self, state):
+        total = 0
+        for mask, distances in self.databases:
+            distance = distances.get(state & mask)
+            if distance is None:
+                return self.INFINITY
+            total += distance
+        return total
+
+
+def get_heuristic(name, state):
+    # heuristic function for boards with the same pieces as state
+    if name == 'manhattan':
+        return manhattan
+    if name == 'pdb':
+        return PatternHeuristic(state)
+    raise ValueError(f'Unknown heuristic {name!r}')
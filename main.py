@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 from argparse import ArgumentParser
 
+from solver import SEARCHES
+
 # Parsing command-line arguments
 description = """
     Klotski Puzzle is yet another sliding block puzzle.
@@ -10,8 +12,11 @@ description = """
     Note: It takes at-least 81 steps to solve the puzzle.
 
     Use the arrow keys to undo or redo step(s).
+    Drag along the timeline below the steps to jump to a step,
+    or press Home (or End) to jump to the first (or last) step.
     Press R to reset the board.
     Press A (or S) for computer solution.
+    Press H to show (or hide) hints.
     Press Q to quit.
 
     This application is implemented in python using PyGame module.
@@ -21,24 +26,42 @@ parser = ArgumentParser(description=description, epilog='Author: tdrk')
 parser.add_argument('--record', default=False, action='store_true', help='record game screen')
 parser.add_argument('--output', default='output.avi',
                     help='file to output recording. must have an .avi extension. default: output.avi ')
-args = parser.parse_args()
+parser.add_argument('--replay', default=None, metavar='FILE',
+                    help='file to save the replay of the game to on quitting, see replay.py')
+parser.add_argument('--hints', default=False, action='store_true',
+                    help='show the distance to the goal and the best next move, toggled with H')
+parser.add_argument('--cache', default=None, metavar='FILE',
+                    help='file to keep the solutions found across sessions. default: kept in memory only')
+parser.add_argument('--solver', default='bfs', choices=list(SEARCHES),
+                    help='auto-solver engine, used when the distance table is not built. default: bfs')
+# Parsed before importing pygame, so that --help is quick.
+# When imported as a module (e.g. by a worker process), the defaults apply.
+args = parser.parse_args() if __name__ == '__main__' else parser.parse_args([])
 RECORD_SCREEN = args.record
 OUTPUT_FILE = args.output
+SOLVER = args.solver
+HINTS = args.hints
+CACHE_FILE = args.cache
+REPLAY_FILE = args.replay
 
-import threading
+import sys
+import time
 from math import pi
 
 import pygame
 
-from game import Board, Position
-from recorder import ScreenRecorder
-from solver import bfs_solver
+from background import SolverProcess, build_table
+from bitboard import decode_move, encode, path_to_moves
+from cache import SolutionCache
+from database import DistanceTable
+from game import POSITIONS, Board, Position
 from utilities import darken_color
 
 pygame.font.init()
 
 TILE_SIZE = 100
 main_font = pygame.font.Font(None, 50)
+info_font = pygame.font.Font(None, 24)
 FONT_HEIGHT = main_font.get_height()
 MARGIN = int(TILE_SIZE * 0.1)
 
@@ -53,19 +76,37 @@ BOARD_SIZE = 4 * TILE_SIZE, 5 * TILE_SIZE
 SCORE_OFFSETS = 0, HEIGHT - 2 * FONT_HEIGHT
 SCORE_SIZE = WIDTH, 2 * FONT_HEIGHT
 
+# Timeline of the history, along the bottom of the score card
+TIMELINE_RECT = pygame.Rect(MARGIN, HEIGHT - MARGIN, WIDTH - 2 * MARGIN, MARGIN // 2)
+
 # Title positions
 TITLE_OFFSETS = 0, 0
 TITLE_SIZE = WIDTH, 2 * FONT_HEIGHT
 
 FPS = 60
-win = pygame.display.set_mode((WIDTH, HEIGHT))
-clock = pygame.time.Clock()
-pygame.display.set_caption('Klotski Puzzle')
+
+# Optimal moves are looked up when the distance table is built, see database.py
+DISTANCE_TABLE = DistanceTable.load()
+# Otherwise, the paths solved are cached, shared by the auto-solver and the hints
+SOLUTION_CACHE = SolutionCache(path=CACHE_FILE)
+
+# The solvers run in a separate process, so that the CPU bound search
+# does not compete with the game loop for the GIL. Started on first use.
+solver_process = None
+
+
+def get_solver_process():
+    global solver_process
+    if solver_process is None:
+        solver_process = SolverProcess()
+    return solver_process
 
 
 class AutoSolver:
     """
-        Wrapper around the bfs_solver, maintains state useful for the game.
+        Wrapper around the solvers, maintains state useful for the game.
+        Uses the distance table when available, then the solutions cached,
+        and falls back to the selected solver otherwise.
         Main States:
             enabled: When the solver is running
                 - loading: When the solver is running and computing the steps async
@@ -73,24 +114,23 @@ class AutoSolver:
     """
     INTERVAL = int(FPS * 0.5)
 
-    def __init__(self, board):
+    def __init__(self, board, solver=SOLVER):
         self.board = board
+        self.solver = solver  # search engine, see solver.SEARCHES
         self.enabled = False  # whether auto-solver is running
         self.steps = None  # remaining steps to take
 
         # For computing the steps asynchronously
-        # in another thread
-        self.lock = threading.Lock()
-        self.thread = None  # reference to the computation thread
-        # NOTE: self.steps and self.thread is shared between threads, access needs a lock
+        # in the solver process
+        self.future = None  # result of the computation in progress
+        self.start_time = None  # when the computation was submitted
 
         self.timer = 0  # just a counter to maintain an interval between steps
 
     @property
     def loading(self):
-        # Checks if async thread is running
-        with self.lock:
-            return self.enabled and self.steps is None
+        # Checks if the steps are being computed
+        return self.enabled and self.steps is None
 
     def enable(self, interval=INTERVAL):
         # To enable the auto-solver
@@ -99,47 +139,156 @@ class AutoSolver:
         self.INTERVAL = interval
 
     def fetch_steps(self):
-        # This method is called asynchronously
-        # This is an CPU intensive blocking task.
-        # updates the steps once computed.
-        steps = bfs_solver(self.board)
-        with self.lock:
-            # modify shared variables after acquiring lock
-            self.steps = steps
-            self.thread = None
+        # Looks up the steps in the distance table or the cache, otherwise starts computing them
+        # in the solver process. The board is sent over as its encoded state.
+        if DISTANCE_TABLE is not None:
+            self.steps = DISTANCE_TABLE.solver(self.board)
+        if self.steps is None:
+            path = SOLUTION_CACHE.solve(encode(self.board))
+            if path is not None:
+                self.steps = path_to_moves(path, self.board)
+        if self.steps is None:
+            self.future = get_solver_process().submit(encode(self.board), self.solver)
+            self.start_time = time.perf_counter()
+
+    def collect_steps(self):
+        # Maps the path computed by the solver process back to the pieces of the board
+        path = self.future.result()
+        self.future = None
+        if path:
+            SOLUTION_CACHE.add_path(path)
+        self.steps = path_to_moves(path, self.board) if path else []
+
+    @property
+    def progress(self):
+        # Progress of the search in progress, if any
+        if self.future is None:
+            return None
+        return get_solver_process().poll()
+
+    @property
+    def throughput(self):
+        # States expanded per second by the search in progress, None until it reports
+        progress = self.progress
+        if progress is None or not progress.expanded:
+            return None
+        return progress.expanded / (time.perf_counter() - self.start_time)
+
+    def cancel(self):
+        # Stops the auto-solver, along with the search in progress
+        if self.future is not None:
+            get_solver_process().cancel()
+            self.future = None
+        self.steps = None
+        self.enabled = False
 
     def loop(self):
         # The main loop, to be called with every iteration of game loop
         # it modifies the board, when auto-solver is enabled.
         if self.enabled:
-            with self.lock:
-                # Steps not yet computed
-                if self.steps is None:
-                    # Compute the steps, asynchronously
-                    if self.thread is None:
-                        # launch a thread to compute the steps
-                        self.thread = threading.Thread(target=self.fetch_steps)
-                        self.thread.start()
-                    # Computation is in progress
-
-                # All the steps applied
-                elif len(self.steps) == 0:
-                    # Exit the auto-solver mode
-                    self.steps = None
-                    self.enabled = False
-
-                # Adjust timer
-                elif self.timer > 0:
-                    # Timer to control the speed of solver
-                    self.timer -= 1
-
-                # Apply the steps after count-down
+            # Steps not yet computed
+            if self.steps is None:
+                # Compute the steps, asynchronously
+                if self.future is None:
+                    self.fetch_steps()
+                # Computation is done
+                elif self.future.done():
+                    self.collect_steps()
+
+            # All the steps applied
+            elif len(self.steps) == 0:
+                # Exit the auto-solver mode
+                self.steps = None
+                self.enabled = False
+
+            # Adjust timer
+            elif self.timer > 0:
+                # Timer to control the speed of solver
+                self.timer -= 1
+
+            # Apply the steps after count-down
+            else:
+                # MODIFIES THE BOARD!
+                piece, move = self.steps.pop(0)
+                self.board.move(piece, move)
+                # Reset the timer ..
+                self.timer = self.INTERVAL
+
+
+class Hints:
+    """
+        Hints for the player, the distance to the goal and the optimal next move.
+        Looked up in the distance table, which is built in the background when missing.
+        Until it is built, the solutions cached are followed while the board stays on them,
+        otherwise the position is solved in the solver process.
+    """
+
+    def __init__(self, enabled=HINTS):
+        self.enabled = enabled
+        self.table_future = None  # build of the distance table in progress
+        self.table_failed = False  # the build failed, the table is not built again
+        self.future = None  # search in progress
+        self.future_state = None  # state the search is for
+        self.state = None  # state of the board the hint is for
+        self.hint = None  # (distance, piece, position) for the state
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+    def distance_table(self):
+        # The distance table, starts building it if missing, None until built
+        global DISTANCE_TABLE
+        if DISTANCE_TABLE is None and not self.table_failed:
+            if self.table_future is None:
+                self.table_future = build_table()
+            elif self.table_future.done():
+                error = self.table_future.exception()
+                if error is not None:
+                    # e.g. a read-only directory, the solver process gives the hints instead
+                    print(f'Could not build the distance table: {error}', file=sys.stderr)
                 else:
-                    # MODIFIES THE BOARD!
-                    piece, move = self.steps.pop(0)
-                    self.board.move(piece, move)
-                    # Reset the timer ..
-                    self.timer = self.INTERVAL
+                    DISTANCE_TABLE = DistanceTable.load()
+                self.table_failed = DISTANCE_TABLE is None
+        return DISTANCE_TABLE
+
+    def next_state(self, state):
+        # (distance, next state) of the state, None if not known yet
+        table = self.distance_table()
+        if table is not None:
+            distance = table.distance(state)
+            if distance is not None:
+                return distance, table.next_state(state)
+        return SOLUTION_CACHE.lookup(state)
+
+    def update(self, board, solver):
+        # Returns the hint for the board, None if disabled or not known yet.
+        # Hints are for the player, so there are none while the auto-solver runs.
+        if not self.enabled or solver.enabled:
+            return None
+        state = encode(board)
+        if self.future is not None and self.future.done():
+            path = self.future.result()
+            self.future = None
+            if path:
+                SOLUTION_CACHE.add_path(path)
+                self.state = None
+        if state == self.state:
+            return self.hint
+
+        found = self.next_state(state)
+        if found is None:
+            if self.future is None or self.future_state != state:
+                # the search for an earlier state, if any, is no longer needed
+                self.future = get_solver_process().submit(state, SOLVER)
+                self.future_state = state
+            return None
+        distance, new_state = found
+        self.state = state
+        self.hint = distance, None, None
+        if new_state is not None:
+            _, source, destination = decode_move(state, new_state)
+            self.hint = distance, board.get_piece(POSITIONS[source]), POSITIONS[destination]
+        return self.hint
 
 
 class Loader:
@@ -164,57 +313,153 @@ class Loader:
         self.end_angle = (self.end_angle - self.INCREMENT) % (2 * pi)
 
 
+class Renderer:
+    """
+        Draws the frames of the game onto the window, retained-mode.
+        The static parts are drawn once, the board and the step label only when they change,
+        and the spinner while loading. draw returns the rects of the window which changed.
+    """
+    BOARD_COLOR = (205, 127, 50)
+    TEXT_BACKGROUND = (0, 100, 255)
+    TEXT_COLOR = (255, 255, 255)
+    HINT_COLOR = (0, 255, 127)
+    TIMELINE_COLOR = (0, 60, 160)
+
+    def __init__(self, win):
+        self.win = win
+        # The window without the board and the steps label
+        self.background = pygame.Surface(win.get_size())
+        self.background.fill(darken_color(self.BOARD_COLOR, 0.5))
+        pygame.draw.rect(self.background, self.TEXT_BACKGROUND, (TITLE_OFFSETS, TITLE_SIZE))
+        title_label = main_font.render(f"KLOTSKI PUZZLE", 1, self.TEXT_COLOR)
+        self.background.blit(title_label,
+                             (TITLE_OFFSETS[0] + TITLE_SIZE[0] // 2 - title_label.get_width() // 2,
+                              TITLE_OFFSETS[1] + TITLE_SIZE[1] // 2 - title_label.get_height() // 2))
+        pygame.draw.rect(self.background, self.TEXT_BACKGROUND, (SCORE_OFFSETS, SCORE_SIZE))
+
+        # A surface to draw the board onto..
+        self.board_surf = pygame.Surface(BOARD_SIZE)
+        self.board_rect = pygame.Rect(BOARD_OFFSETS, BOARD_SIZE)
+        self.score_rect = pygame.Rect(SCORE_OFFSETS, SCORE_SIZE)
+        self.loader_rect = pygame.Rect((WIDTH // 2 - TILE_SIZE // 2, HEIGHT // 2 - TILE_SIZE // 2, TILE_SIZE, TILE_SIZE))
+
+        # What was drawn last, to find out what changed
+        self.board_key = None
+        self.score = None
+        self.overlay_rect = None  # area of the window covered by the spinner
+        self.invalidate()
+
+    def invalidate(self):
+        # Redraw everything with the next frame
+        self.board_key = None
+        self.score = None
+        self.overlay_rect = None
+        self.win.blit(self.background, (0, 0))
+        self.full_redraw = True
+
+    def draw_board(self, board, hint):
+        self.board_surf.fill(self.BOARD_COLOR)
+        board.draw(self.board_surf, TILE_SIZE)
+        if hint is not None and hint[1] is not None:
+            # Outline the piece to move next, and where it goes
+            _, piece, position = hint
+            width = int(TILE_SIZE * 0.05)
+            for x, y in piece.position, position:
+                pygame.draw.rect(self.board_surf, self.HINT_COLOR,
+                                 (x * TILE_SIZE, y * TILE_SIZE, piece.WIDTH * TILE_SIZE, piece.HEIGHT * TILE_SIZE),
+                                 width)
+        if board.is_solved:
+            # Show the message when game is solved
+            # NOTE: Game does not end when puzzle is solved, user can continue..
+            success_label = main_font.render(f"Congratulations!", 1, self.TEXT_COLOR)
+            self.board_surf.blit(success_label,
+                                 (BOARD_SIZE[0] // 2 - success_label.get_width() // 2,
+                                  BOARD_SIZE[1] // 2 - success_label.get_height() // 2))
+        self.win.blit(self.board_surf, BOARD_OFFSETS)
+
+    def draw_steps(self, steps, distance, history_length):
+        self.win.blit(self.background, self.score_rect, self.score_rect)
+        text = f"Step {steps}" if distance is None else f"Step {steps}, {distance} to go"
+        steps_label = main_font.render(text, 1, self.TEXT_COLOR)
+        self.win.blit(steps_label,
+                      (SCORE_OFFSETS[0] + SCORE_SIZE[0] // 2 - steps_label.get_width() // 2,
+                       SCORE_OFFSETS[1] + SCORE_SIZE[1] // 2 - steps_label.get_height() // 2))
+
+        if history_length:
+            # The timeline, filled up to the current step
+            pygame.draw.rect(self.win, self.TIMELINE_COLOR, TIMELINE_RECT)
+            filled = TIMELINE_RECT.copy()
+            filled.width = TIMELINE_RECT.width * steps // history_length
+            pygame.draw.rect(self.win, self.TEXT_COLOR, filled)
+
+    def draw_overlay(self, solver, loader):
+        # Show a loader when auto-solver is computing the moves,
+        # along with the live throughput of the search.
+        loader.draw(self.win, self.loader_rect)
+        rect = self.loader_rect.copy()
+        throughput = solver.throughput
+        if throughput is not None:
+            throughput_label = info_font.render(f"{throughput:,.0f} nodes/s", 1, self.TEXT_COLOR)
+            label_rect = self.win.blit(throughput_label,
+                                       (WIDTH // 2 - throughput_label.get_width() // 2,
+                                        self.loader_rect.bottom + MARGIN))
+            rect.union_ip(label_rect)
+        return rect
+
+    def draw(self, board, solver, loader, hint=None):
+        # Draws a frame of the game onto the window, returns the dirty rects.
+        # hint is (distance, piece, position) of the optimal next move, see Hints.
+        dirty = []
+        if self.overlay_rect is not None:
+            # Restore the board under the spinner of the last frame
+            self.win.blit(self.board_surf, self.overlay_rect,
+                          self.overlay_rect.move(-BOARD_OFFSETS[0], -BOARD_OFFSETS[1]))
+            dirty.append(self.overlay_rect)
+            self.overlay_rect = None
+
+        # pieces are moved in place, so the board is compared by the positions of its pieces
+        board_key = board, [piece.position for piece in board.pieces], hint
+        if board_key != self.board_key:
+            self.board_key = board_key
+            self.draw_board(board, hint)
+            dirty.append(self.board_rect)
+
+        score = board.number_of_steps, (hint[0] if hint is not None else None), len(board.history)
+        if score != self.score:
+            self.score = score
+            self.draw_steps(*score)
+            dirty.append(self.score_rect)
+
+        if solver.loading:
+            self.overlay_rect = self.draw_overlay(solver, loader)
+            dirty.append(self.overlay_rect)
+
+        if self.full_redraw:
+            self.full_redraw = False
+            return [self.win.get_rect()]
+        return dirty
+
+
 def game():
+    # The window is opened here rather than on import
+    win = pygame.display.set_mode((WIDTH, HEIGHT))
+    clock = pygame.time.Clock()
+    pygame.display.set_caption('Klotski Puzzle')
+
     # For screen-casting
     if RECORD_SCREEN:
+        # imported here, as cv2 is slow to load and only needed for recording
+        from recorder import ScreenRecorder
         recorder = ScreenRecorder(WIDTH, HEIGHT, FPS, out_file=OUTPUT_FILE)
     run = True
     board = Board.from_start_position()
     solver = AutoSolver(board)
     selected_piece = None
+    scrubbing = False  # whether the timeline is being dragged
 
-    # A surface to draw the board onto..
-    board_surf = pygame.Surface(BOARD_SIZE)
+    renderer = Renderer(win)
     loader = Loader()
-
-    def draw():
-        board_color = (205, 127, 50)
-        text_background = (0, 100, 255)
-        text_color = (255, 255, 255)
-        # Fill the window and the board
-        win.fill(darken_color(board_color, 0.5))
-        board_surf.fill(board_color)
-
-        # Draw the title label onto the window
-        pygame.draw.rect(win, text_background, (TITLE_OFFSETS, TITLE_SIZE))
-        title_label = main_font.render(f"KLOTSKI PUZZLE", 1, text_color)
-        win.blit(title_label,
-                 (TITLE_OFFSETS[0] + TITLE_SIZE[0] // 2 - title_label.get_width() // 2,
-                  TITLE_OFFSETS[1] + TITLE_SIZE[1] // 2 - title_label.get_height() // 2))
-
-        # Draw the steps label onto the window
-        pygame.draw.rect(win, text_background, (SCORE_OFFSETS, SCORE_SIZE))
-        steps_label = main_font.render(f"Step {board.number_of_steps}", 1, text_color)
-        win.blit(steps_label,
-                 (SCORE_OFFSETS[0] + SCORE_SIZE[0] // 2 - steps_label.get_width() // 2,
-                  SCORE_OFFSETS[1] + SCORE_SIZE[1] // 2 - steps_label.get_height() // 2))
-
-        # Draw the board and copy it onto the window
-        board.draw(board_surf, TILE_SIZE)
-        win.blit(board_surf, BOARD_OFFSETS)
-
-        if board.is_solved:
-            # Show the message when game is solved
-            # NOTE: Game does not end when puzzle is solved, user can continue..
-            success_label = main_font.render(f"Congratulations!", 1, text_color)
-            win.blit(success_label,
-                     (BOARD_OFFSETS[0] + BOARD_SIZE[0] // 2 - success_label.get_width() // 2,
-                      BOARD_OFFSETS[1] + BOARD_SIZE[1] // 2 - success_label.get_height() // 2))
-
-        if solver.loading:
-            # Show a loader when auto-solver is computing the moves.
-            loader.draw(win,
-                        pygame.Rect((WIDTH // 2 - TILE_SIZE // 2, HEIGHT // 2 - TILE_SIZE // 2, TILE_SIZE, TILE_SIZE)))
+    hints = Hints()
 
     def handle_select(pos):
         # Handles mouse button down event.
@@ -239,26 +484,33 @@ def game():
                 if possible_pos:
                     board.move(selected_piece, possible_pos)
 
+    def handle_scrub(pos):
+        # Jumps to the step of the timeline under the mouse
+        offset = min(max(pos[0] - TIMELINE_RECT.x, 0), TIMELINE_RECT.width)
+        board.seek(round(offset * len(board.history) / TIMELINE_RECT.width))
+
     def reset():
         # creates a new board to reset it
         nonlocal board, selected_piece, solver
+        # the search for the old board is stale
+        solver.cancel()
         board = Board.from_start_position()
         selected_piece = None
         # Reset the solver as well
         solver = AutoSolver(board)
 
     def handle_user_event(_event):
-        nonlocal selected_piece
+        nonlocal selected_piece, scrubbing
         if _event.type == pygame.KEYDOWN:
-            # Board reset
-            if _event.key == pygame.K_r:
-                reset()
-
             # History events
             if _event.key == pygame.K_LEFT:
                 board.history_back()
             if _event.key == pygame.K_RIGHT:
                 board.history_forward()
+            if _event.key == pygame.K_HOME:
+                board.seek(0)
+            if _event.key == pygame.K_END:
+                board.seek(len(board.history))
 
             # Solver
             if _event.key == pygame.K_a:  # Normal Solver
@@ -268,17 +520,33 @@ def game():
                 selected_piece = None
                 solver.enable(int(FPS * 0.1))
 
+            if _event.key == pygame.K_h:  # Hints
+                hints.toggle()
+
         if _event.type == pygame.MOUSEBUTTONDOWN and _event.button == 1:  # left click
-            handle_select(_event.pos)
+            # the timeline is given some slack, as it is thin
+            if board.history and TIMELINE_RECT.inflate(0, MARGIN).collidepoint(_event.pos):
+                scrubbing = True
+                selected_piece = None
+                handle_scrub(_event.pos)
+            else:
+                handle_select(_event.pos)
+
+        if _event.type == pygame.MOUSEMOTION and scrubbing:
+            handle_scrub(_event.pos)
 
         if _event.type == pygame.MOUSEBUTTONUP and _event.button == 1:  # left click
-            handle_drop(_event.pos)
+            if scrubbing:
+                scrubbing = False
+            else:
+                handle_drop(_event.pos)
 
     while run:
-        draw()
-        pygame.display.update()
+        # Only the parts of the window which changed are updated
+        dirty = renderer.draw(board, solver, loader, hints.update(board, solver))
+        pygame.display.update(dirty)
         if RECORD_SCREEN:
-            recorder.capture_frame(win)
+            recorder.capture_frame(win, changed=bool(dirty))
         solver.loop()
 
         for event in pygame.event.get():
@@ -286,7 +554,10 @@ def game():
                     (event.type == pygame.KEYDOWN and event.key == pygame.K_q):
                 run = False
 
-            if not solver.enabled:
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+                # Board reset, also interrupts the auto-solver
+                reset()
+            elif not solver.enabled:
                 # User inputs taken only when solver not running
                 handle_user_event(event)
 
@@ -303,6 +574,13 @@ def game():
 
     if RECORD_SCREEN:
         recorder.stop()
+    if REPLAY_FILE:
+        # imported here, as only needed for saving the replay
+        from replay import save
+        save(board, REPLAY_FILE)
+    if solver_process is not None:
+        solver_process.shutdown()
+    SOLUTION_CACHE.close()
     pygame.quit()
 
 
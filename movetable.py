@@ -0,0 +1,108 @@
+"""
+    Move tables, built once per board geometry.
+
+    Cells are numbered row by row (cell = y * width + x) and a set of cells is a
+    bitmask over these numbers. Given the shape of a piece, its anchor (top-left)
+    cell and the mask of the empty cells, a table returns the legal destinations
+    with a single lookup.
+"""
+from functools import lru_cache
+
+# Piece shapes as (width, height)
+SHAPES = ((1, 1), (1, 2), (2, 1), (2, 2))
+
+
+class MoveTable:
+    def __init__(self, width, height, shapes=SHAPES, empties=2):
+        # empties is the number of empty cells on the board
+        self.width = width
+        self.height = height
+        self.cells = width * height
+
+        # footprints[shape][cell] - mask of cells covered by the piece anchored at cell,
+        # None when the piece does not fit on the board there.
+        self.footprints = {shape: tuple(self._footprint(shape, cell) for cell in range(self.cells))
+                           for shape in shapes}
+
+        # moves[shape][cell] - list of (need, destination, click), where need is the mask
+        # of cells which must be empty to move to destination, and click is the mask of
+        # cells the user drags the piece onto for that move (used by the UI).
+        self.moves = {shape: tuple(self._moves(shape, cell, empties) for cell in range(self.cells))
+                      for shape in shapes}
+
+        # table[shape][cell] - maps the mask of empty cells to a tuple of (destination, click)
+        self.table = {shape: tuple(self._index(shape, cell, empties) for cell in range(self.cells))
+                      for shape in shapes}
+
+    def lookup(self, shape, cell, empty):
+        # legal (destination, click) pairs for the piece, empty is the mask of empty cells
+        return self.table[shape][cell].get(empty, ())
+
+    def _footprint(self, shape, cell):
+        width, height = shape
+        x, y = cell % self.width, cell // self.width
+        if x + width > self.width or y + height > self.height:
+            return None
+        mask = 0
+        for dy in range(height):
+            for dx in range(width):
+                mask |= 1 << (cell + dy * self.width + dx)
+        return mask
+
+    def _steps(self, shape, cell):
+        # anchors reachable by sliding the piece by one cell
+        x, y = cell % self.width, cell // self.width
+        for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+            if 0 <= x + dx < self.width and 0 <= y + dy < self.height:
+                new_cell = cell + dy * self.width + dx
+                if self.footprints[shape][new_cell] is not None:
+                    yield new_cell
+
+    def _moves(self, shape, cell, empties):
+        # A move slides a piece through the empty cells, possibly turning a corner,
+        # and counts as a single step however far the piece goes.
+        origin = self.footprints[shape][cell]
+        if origin is None:
+            return []
+        moves = {}
+        paths = [(cell, 0)]  # (anchor, need) of the partial moves
+        while paths:
+            anchor, need = paths.pop()
+            for step in self._steps(shape, anchor):
+                if step == cell:
+                    continue
+                new_need = need | self.footprints[shape][step] & ~origin
+                if bin(new_need).count('1') > empties or new_need == need:
+                    continue
+                if (step, new_need) not in moves:
+                    # only the newly entered cells select this move in the UI
+                    moves[step, new_need] = new_need & ~need
+                    paths.append((step, new_need))
+        return [(need, destination, click) for (destination, need), click in moves.items()]
+
+    def _index(self, shape, cell, empties):
+        origin = self.footprints[shape][cell]
+        if origin is None:
+            return {}
+        free_cells = [_cell for _cell in range(self.cells) if not origin >> _cell & 1]
+        index = {}
+        for need, destination, click in self.moves[shape][cell]:
+            for empty in _combinations(free_cells, empties):
+                if need & empty == need:
+                    index.setdefault(empty, []).append((destination, click))
+        return {empty: tuple(moves) for empty, moves in index.items()}
+
+
+def _combinations(cells, count):
+    # masks of every combination of count cells
+    if count == 0:
+        yield 0
+        return
+    for i, cell in enumerate(cells):
+        for mask in _combinations(cells[i + 1:], count - 1):
+            yield 1 << cell | mask
+
+
+@lru_cache(maxsize=None)
+def get_move_table(width, height):
+    return MoveTable(width, height)
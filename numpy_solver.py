@@ -0,0 +1,159 @@
+"""
+    Breadth first search over whole levels at once, with numpy.
+
+    A level is an (n, 4) array of the shape masks of its states (see bitboard).
+    The successors of a level are generated together, by testing every move of the
+    move table against every state, and are deduplicated on packed 64 bit keys.
+    As moves are reversible, the successors of a level can only be in the level before,
+    the level itself or the next level, so only those are kept to find the new states.
+"""
+import numpy as np
+
+from bitboard import CELL_MASK, CELLS, MAIN_SHAPE, GOAL_BIT, MIRROR, SHAPES, WIDTH, is_solved
+from game import MOVE_TABLE
+from solver import PROGRESS_INTERVAL, SearchStats
+
+# states tested against all the moves at a time, bounds the memory of a step
+CHUNK_SIZE = 4096
+
+
+def _move_arrays():
+    # every move of the table as (shape, anchor bit, mask of the cells to be empty, toggle)
+    moves = []
+    for shape, piece_class in enumerate(SHAPES):
+        for cell, cell_moves in enumerate(MOVE_TABLE.moves[piece_class.WIDTH, piece_class.HEIGHT]):
+            for need, destination, _ in cell_moves:
+                moves.append((shape, 1 << cell, need, (1 << cell) | (1 << destination)))
+    shapes, anchors, needs, toggles = zip(*moves)
+    return (np.array(shapes, np.intp), np.array(anchors, np.uint32), np.array(needs, np.uint32),
+            np.array(toggles, np.uint32))
+
+
+MOVE_SHAPES, MOVE_ANCHORS, MOVE_NEEDS, MOVE_TOGGLES = _move_arrays()
+
+# A key holds 3 bits per cell, 0 when no piece is anchored there, otherwise the shape + 1.
+# SPREAD[shape][half] spreads the anchors of half of the cells of a mask into the key.
+HALF = CELLS // 2
+SPREAD = np.array([[sum((shape + 1) << (3 * cell) for cell in range(HALF) if half >> cell & 1)
+                    for half in range(1 << HALF)] for shape in range(len(SHAPES))], np.uint64)
+# MIRRORS[shape] mirrors three rows of anchors, as bitboard.MIRROR
+MIRRORS = np.array(MIRROR, np.uint32)
+MIRROR_BITS = 3 * WIDTH
+GOAL_MASK = np.uint32(GOAL_BIT >> (MAIN_SHAPE * CELLS))
+
+
+def to_masks(state):
+    return np.array([[(state >> (shape * CELLS)) & CELL_MASK for shape in range(len(SHAPES))]], np.uint32)
+
+
+def from_key(key):
+    # the state of a packed key
+    key, state = int(key), 0
+    for cell in range(CELLS):
+        value = key >> (3 * cell) & 7
+        if value:
+            state |= 1 << ((value - 1) * CELLS + cell)
+    return state
+
+
+def keys_of(masks):
+    keys = np.zeros(len(masks), np.uint64)
+    for shape in range(len(SHAPES)):
+        column = masks[:, shape]
+        keys |= SPREAD[shape][column & ((1 << HALF) - 1)]
+        keys |= SPREAD[shape][column >> HALF] << np.uint64(3 * HALF)
+    return keys
+
+
+def mirror_masks(masks):
+    mirrored = np.empty_like(masks)
+    for shape in range(len(SHAPES)):
+        column = masks[:, shape]
+        mirrored[:, shape] = MIRRORS[shape][column & ((1 << MIRROR_BITS) - 1)] | \
+            MIRRORS[shape][column >> MIRROR_BITS] << MIRROR_BITS
+    return mirrored
+
+
+def empty_masks(masks):
+    m1x1, m1x2, m2x1, m2x2 = masks.T
+    occupied = (m1x1 | m1x2 | m1x2 << WIDTH | m2x1 | m2x1 << 1 |
+                m2x2 | m2x2 << 1 | m2x2 << WIDTH | m2x2 << (WIDTH + 1))
+    return ~occupied & CELL_MASK
+
+
+def fold(masks):
+    # Folds the states with their mirror images, returns the masks and the keys of the states,
+    # the smaller key of a state and its mirror image represents both.
+    keys = keys_of(masks)
+    mirrored = mirror_masks(masks)
+    mirrored_keys = keys_of(mirrored)
+    smaller = mirrored_keys < keys
+    masks[smaller] = mirrored[smaller]
+    keys[smaller] = mirrored_keys[smaller]
+    return masks, keys
+
+
+def expand(masks):
+    # Returns the successors of the states as folded masks and keys,
+    # along with the index of the state each was reached from.
+    empty = empty_masks(masks)[:, None]
+    legal = ((masks[:, MOVE_SHAPES] & MOVE_ANCHORS) != 0) & ((empty & MOVE_NEEDS) == MOVE_NEEDS)
+    parents, moves = np.nonzero(legal)
+    new_masks = masks[parents]
+    new_masks[np.arange(len(moves)), MOVE_SHAPES[moves]] ^= MOVE_TOGGLES[moves]
+    return (*fold(new_masks), parents)
+
+
+def numpy_search(start_state, stats=None):
+    # BFS one level at a time, the path is rebuilt from the parent indices of the levels.
+    stats = stats or SearchStats()
+    if is_solved(start_state):
+        return [start_state]
+
+    masks, keys = fold(to_masks(start_state))
+    previous_keys = keys[:0]
+    # keys of the states of every level and the indices of their parents in the level before
+    levels = [(keys, None)]
+    depth = expanded = duplicates = 0
+    visited = 1
+    chunk = max(CHUNK_SIZE, PROGRESS_INTERVAL)
+
+    while len(masks):
+        yield stats.update(depth, expanded, len(masks), duplicates, visited)
+        new_masks, new_keys, parents = [], [], []
+        for start in range(0, len(masks), chunk):
+            _masks, _keys, _parents = expand(masks[start: start + chunk])
+            new_masks.append(_masks)
+            new_keys.append(_keys)
+            parents.append(_parents + start)
+            expanded += len(masks[start: start + chunk])
+            if start + chunk < len(masks):
+                yield stats.update(depth, expanded, len(masks), duplicates, visited)
+        new_masks, new_keys, parents = map(np.concatenate, (new_masks, new_keys, parents))
+
+        # the first occurrence of each state, unless it is in this level or the one before
+        unique_keys, first = np.unique(new_keys, return_index=True)
+        new = ~np.isin(unique_keys, previous_keys) & ~np.isin(unique_keys, keys)
+        duplicates += len(new_keys) - np.count_nonzero(new)
+        first = first[new]
+        previous_keys, keys = keys, unique_keys[new]
+        masks = new_masks[first]
+        levels.append((keys, parents[first]))
+        visited += len(keys)
+        depth += 1
+
+        solved = np.nonzero(masks[:, MAIN_SHAPE] & GOAL_MASK)[0]
+        if len(solved):
+            yield stats.update(depth, expanded, len(masks), duplicates, visited)
+            stats.bytes_per_state = sum(level_keys.nbytes + (level_parents.nbytes if level_parents is not None else 0)
+                                        for level_keys, level_parents in levels) / visited
+            # follow the parent indices back to the start
+            index = solved[0]
+            path = []
+            for level_keys, level_parents in reversed(levels):
+                path.append(from_key(level_keys[index]))
+                if level_parents is not None:
+                    index = level_parents[index]
+            path.reverse()
+            return path
+    return None
@@ -0,0 +1,114 @@
+"""
+    Parallel level-synchronous exploration of the state space.
+
+    Canonical states (see bitboard) are sharded across a pool of worker processes by
+    hash partition. For every level, each worker expands its share of the frontier and
+    buckets the new states by their owner. The workers send the buckets to each other
+    directly, through a queue per worker, and each owner deduplicates the states it
+    receives against its own visited set. The coordinator only starts the levels and
+    adds up the counts.
+
+        python parallel.py --processes 32
+"""
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pipe, Process, Queue
+
+from bitboard import canonical, canonical_successors, encode, is_solved, mirror
+from database import MULTIPLIER
+from game import Board as _Board
+
+
+def owner(state, shards):
+    # The low bits of a state are the anchors of the 1x1 pieces in the first cells,
+    # they are mixed first so that the shards are even.
+    return (state * MULTIPLIER >> 64) % shards
+
+
+def _worker(connection, inboxes, shard, initial_state):
+    # Owns the states of one shard, reports the counts of every level to the coordinator.
+    # inboxes holds the queue of every worker, the buckets addressed to a worker are put in its queue.
+    shards = len(inboxes)
+    visited_states = set()
+    frontier = []
+
+    def merge(buckets):
+        # keeps the new states of the buckets as the next frontier, returns the counts of the level
+        nonlocal frontier
+        frontier = []
+        boards = solutions = 0
+        for bucket in buckets:
+            for state in bucket:
+                if state not in visited_states:
+                    visited_states.add(state)
+                    frontier.append(state)
+                    # count both a board and its mirror image unless they are the same
+                    weight = 1 if mirror(state) == state else 2
+                    boards += weight
+                    solutions += weight if is_solved(state) else 0
+        return len(frontier), boards, solutions
+
+    connection.send(merge([[initial_state]] if owner(initial_state, shards) == shard else []))
+    while True:
+        command = connection.recv()
+        if command == 'expand':
+            # successors of the frontier, bucketed by shard
+            buckets = [set() for _ in range(shards)]
+            for state in frontier:
+                for new_state in canonical_successors(state):
+                    buckets[owner(new_state, shards)].add(new_state)
+            for target, bucket in enumerate(buckets):
+                if target != shard:
+                    inboxes[target].put(list(bucket))
+            # the buckets of the other workers for this level, a worker only starts
+            # the next level once every worker has reported this one
+            received = [inboxes[shard].get() for _ in range(shards - 1)]
+            connection.send(merge([buckets[shard], *received]))
+        elif command == 'stop':
+            connection.close()
+            return
+
+
+def parallel_explore(processes=None, _board=None):
+    # Counts the boards reachable from _board (the start position by default),
+    # returns (total boards, solved boards).
+    processes = processes or os.cpu_count()
+    initial_state = canonical(encode(_board or _Board.from_start_position()))
+
+    inboxes = [Queue() for _ in range(processes)]
+    connections = []
+    workers = []
+    for shard in range(processes):
+        connection, worker_connection = Pipe()
+        worker = Process(target=_worker, args=(worker_connection, inboxes, shard, initial_state), daemon=True)
+        worker.start()
+        connections.append(connection)
+        workers.append(worker)
+
+    total_boards = solution_boards = 0
+    try:
+        while True:
+            frontier = 0
+            for connection in connections:
+                new_states, boards, solutions = connection.recv()
+                frontier += new_states
+                total_boards += boards
+                solution_boards += solutions
+            if not frontier:
+                break
+            for connection in connections:
+                connection.send('expand')
+    finally:
+        for connection in connections:
+            connection.send('stop')
+        for worker in workers:
+            worker.join()
+
+    print(f"Possible board configurations are {total_boards}, of which {solution_boards} are solutions.")
+    return total_boards, solution_boards
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Counts the boards reachable from the start position in parallel')
+    parser.add_argument('--processes', type=int, default=None, help='number of workers. default: number of cores')
+    parallel_explore(parser.parse_args().processes)
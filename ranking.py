@@ -0,0 +1,159 @@
+"""
+    Perfect ranking of states, for tables indexed by state.
+
+    The legal placements of a multiset of pieces are numbered 0 .. size - 1 in the order
+    bitboard.placements enumerates them. Cells are filled in order, where each free cell is
+    either left empty or anchors a piece. The pieces anchored so far can only cover the next
+    WIDTH + 1 cells, so the number of ways to complete a partial placement only depends on
+    the cell, the occupancy of those cells (the profile) and the pieces left to place.
+    Those numbers are counted once, and summed up to rank a state.
+"""
+from bisect import bisect_right
+from functools import lru_cache
+
+from bitboard import CELLS, FOOTPRINTS, HEIGHT, SHAPES, WIDTH, shape_counts
+
+ROW_MASK = (1 << WIDTH) - 1
+# the anchors of all the shapes in the first row of a state
+ROW_ANCHORS = sum(ROW_MASK << (shape * CELLS) for shape in range(len(SHAPES)))
+STATE_BITS = CELLS * len(SHAPES)
+STATE_MASK = (1 << STATE_BITS) - 1
+
+
+class Ranking:
+    """
+        Maps the states of a multiset of pieces to 0 .. size - 1 and back
+    """
+
+    def __init__(self, counts):
+        self.counts = tuple(counts)
+        area = sum(count * piece_class.WIDTH * piece_class.HEIGHT for count, piece_class in zip(counts, SHAPES))
+        self.empties = CELLS - area
+        # completions of partial placements, keyed by (cell, profile, counts, empties)
+        self._completions = {}
+        # The arguments of the rows, (profile, counts, empties), are numbered as they are met.
+        # Ranking a row, keyed by its argument number and anchors, gives the offset within
+        # the row and the argument number of the next row.
+        self._arguments = [(0, self.counts, self.empties)]
+        self._argument_numbers = {self._arguments[0]: 0}
+        self._rows = [{} for _ in range(HEIGHT)]
+        # Every way to fill a row, keyed by its argument number, as the offsets of the ways
+        # and the (anchors, next argument number) of each, for unranking a row at a time.
+        self._row_fillings = [{} for _ in range(HEIGHT)]
+        self.size = self._count(0, 0, self.counts, self.empties) if self.empties >= 0 else 0
+
+    def _options(self, cell, profile, counts, empties):
+        # Yields (anchor, profile, counts, empties) following each choice for the free cell,
+        # in the order of bitboard.placements. anchor is the bit of the piece, 0 for an empty cell.
+        if empties:
+            yield 0, (profile | 1) >> 1, counts, empties - 1
+        for shape, count in enumerate(counts):
+            footprint = FOOTPRINTS[shape][cell]
+            if count and footprint is not None and not (footprint >> cell) & profile:
+                _counts = counts[:shape] + (count - 1,) + counts[shape + 1:]
+                yield 1 << (shape * CELLS + cell), (profile | footprint >> cell) >> 1, _counts, empties
+
+    def _count(self, cell, profile, counts, empties):
+        # number of ways to complete the placement from cell on
+        if cell == CELLS:
+            return 1
+        if profile & 1:
+            return self._count(cell + 1, profile >> 1, counts, empties)
+        key = cell, profile, counts, empties
+        count = self._completions.get(key)
+        if count is None:
+            count = sum(self._count(cell + 1, *option[1:]) for option in self._options(cell, profile, counts, empties))
+            self._completions[key] = count
+        return count
+
+    def _rank_row(self, row, profile, counts, empties, anchors):
+        # ranks the anchors of a row, cell by cell.
+        # returns the offset within the row, and the arguments for the next row.
+        offset = 0
+        for cell in range(row * WIDTH, (row + 1) * WIDTH):
+            if profile & 1:
+                profile >>= 1
+                continue
+            # the bit of the piece anchored at the cell, 0 if the cell is empty
+            choice = 0
+            for shape in range(len(SHAPES)):
+                choice |= anchors & 1 << (shape * CELLS + cell)
+            for anchor, *_next in self._options(cell, profile, counts, empties):
+                if anchor == choice:
+                    profile, counts, empties = _next
+                    break
+                offset += self._count(cell + 1, *_next)
+            else:
+                raise ValueError(f'Not a placement of {self.counts}')
+        return offset, profile, counts, empties
+
+    def _number(self, arguments):
+        # number of the arguments of a row
+        if arguments not in self._argument_numbers:
+            self._argument_numbers[arguments] = len(self._arguments)
+            self._arguments.append(arguments)
+        return self._argument_numbers[arguments]
+
+    def _step(self, row, number, anchors):
+        offset, *arguments = self._rank_row(row, *self._arguments[number], anchors)
+        return offset, self._number(tuple(arguments))
+
+    def _fill_row(self, row, number):
+        # the offsets and (anchors, next argument number) of the ways to fill the row,
+        # in rank order, leaving out the ways which cannot be completed
+        offsets, fillings = [], []
+        end = (row + 1) * WIDTH
+
+        def fill(cell, profile, counts, empties, offset, anchors):
+            if cell == end:
+                if self._count(cell, profile, counts, empties):
+                    offsets.append(offset)
+                    fillings.append((anchors, self._number((profile, counts, empties))))
+                return offset + self._count(cell, profile, counts, empties)
+            if profile & 1:
+                return fill(cell + 1, profile >> 1, counts, empties, offset, anchors)
+            for anchor, *_next in self._options(cell, profile, counts, empties):
+                offset = fill(cell + 1, *_next, offset, anchors | anchor)
+            return offset
+
+        fill(row * WIDTH, *self._arguments[number], 0, 0)
+        return offsets, fillings
+
+    def rank(self, state):
+        # index of the state, the state must be a placement of the counts
+        index = number = 0
+        for row, rows in enumerate(self._rows):
+            key = number << STATE_BITS | state & ROW_ANCHORS << (row * WIDTH)
+            step = rows.get(key)
+            if step is None:
+                step = rows[key] = self._step(row, number, key & STATE_MASK)
+            offset, number = step
+            index += offset
+        return index
+
+    def unrank(self, index):
+        # the state with the index, inverse of rank
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        state = number = 0
+        for row, rows in enumerate(self._row_fillings):
+            found = rows.get(number)
+            if found is None:
+                found = rows[number] = self._fill_row(row, number)
+            offsets, fillings = found
+            choice = bisect_right(offsets, index) - 1
+            index -= offsets[choice]
+            anchors, number = fillings[choice]
+            state |= anchors
+        return state
+
+
+@lru_cache(maxsize=None)
+def get_ranking(counts):
+    # counts is a tuple of the number of pieces of each shape
+    return Ranking(counts)
+
+
+def ranking_of(state):
+    # ranking of the placements of the pieces in state
+    return get_ranking(shape_counts(state))
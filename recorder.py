@@ -1,18 +1,70 @@
+from queue import Queue
+from threading import Thread
+
 import cv2
+import numpy as np
 import pygame
 
+# Frames waiting to be written, capture_frame blocks when the writer falls this far behind
+QUEUE_SIZE = 8
+# Tells the writer thread to finish
+_STOP = object()
+
+
 # Refer to https://github.com/tdrmk/pygame_recorder for more details
 class ScreenRecorder:
-    def __init__(self, width, height, fps, out_file = 'output.avi'):
+    """
+        Records frames of a surface to a video file.
+        The frames are copied into reusable buffers and encoded by a writer thread,
+        cv2 releases the GIL while encoding so the game loop is not held up.
+    """
+
+    def __init__(self, width, height, fps, out_file = 'output.avi', queue_size=QUEUE_SIZE):
         # define the codec and create a video writer object
         four_cc = cv2.VideoWriter_fourcc(*'XVID')
         self.video = cv2.VideoWriter(out_file, four_cc, float(fps), (width, height))
 
-    def capture_frame(self, surf):
-        pixels = cv2.rotate(pygame.surfarray.pixels3d(surf), cv2.ROTATE_90_CLOCKWISE)
-        pixels = cv2.flip(pixels, 1)
-        pixels = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
-        self.video.write(pixels)
+        # Buffers not in use, one more than the queue holds for the frame being captured,
+        # and another for the last frame, which the writer keeps to repeat it.
+        self.buffers = Queue()
+        for _ in range(queue_size + 2):
+            self.buffers.put(np.empty((height, width, 3), np.uint8))
+        self.frames = Queue(queue_size)
+        self.captured = False  # whether a frame was captured yet
+
+        self.writer = Thread(target=self._write, daemon=True)
+        self.writer.start()
+
+    def capture_frame(self, surf, changed=True):
+        # When the surface has not changed since the last frame, the last frame is repeated
+        if not changed and self.captured:
+            self.frames.put(None)
+            return
+        buffer = self.buffers.get()
+        pixels = pygame.surfarray.pixels3d(surf)
+        # pixels are indexed (x, y, RGB), video frames (y, x, BGR), the views are copied in one go
+        np.copyto(buffer, pixels.transpose(1, 0, 2)[:, :, ::-1])
+        del pixels  # unlocks the surface
+        self.frames.put(buffer)
+        self.captured = True
+
+    def _write(self):
+        # runs in the writer thread
+        last = None
+        while True:
+            frame = self.frames.get()
+            if frame is _STOP:
+                break
+            if frame is None:
+                frame = last
+            elif last is not None:
+                # the last frame is no longer needed
+                self.buffers.put(last)
+            last = frame
+            self.video.write(frame)
 
     def stop(self):
-        self.video.release()
\ No newline at end of file
+        # writes the pending frames
+        self.frames.put(_STOP)
+        self.writer.join()
+        self.video.release()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+    Renders the solutions of layouts to videos, headless and as fast as the encoder allows.
+
+        ./render.py                          # the start position, to start.avi
+        ./render.py layouts.txt --output-dir videos
+
+    Layouts are read as by batch.py, each video is named after the id of its layout.
+    The frames are drawn as in the game, with no display and no frame rate pacing.
+"""
+import os
+from argparse import ArgumentParser, FileType
+from multiprocessing import Pool
+
+from batch import read_layouts
+from bitboard import encode, path_to_moves
+from game import Board
+from solver import SEARCHES, solve
+
+# seconds each step is shown for, as the normal auto-solver
+STEP_TIME = 0.5
+# seconds the solved board is shown for at the end
+END_TIME = 2
+
+
+def render_solution(board, out_file, engine='bfs', fps=60, step_time=STEP_TIME):
+    # Solves the board and records the solution to out_file, returns the number of moves.
+    # main (and so pygame) is imported here, so that workers only load it when rendering.
+    import pygame
+    import main
+    from recorder import ScreenRecorder
+
+    steps = main.DISTANCE_TABLE.solver(board) if main.DISTANCE_TABLE is not None else None
+    if steps is None:
+        path = solve(encode(board), engine)
+        if path is None:
+            return None
+        steps = path_to_moves(path, board)
+
+    # an off-screen surface the size of the window, no display is needed
+    win = pygame.Surface((main.WIDTH, main.HEIGHT))
+    renderer = main.Renderer(win)
+    solver, loader = main.AutoSolver(board), main.Loader()
+    recorder = ScreenRecorder(main.WIDTH, main.HEIGHT, fps, out_file=out_file)
+
+    def hold(seconds):
+        # the frames after the first are repeats, which the recorder does not copy
+        for _ in range(max(1, int(fps * seconds))):
+            dirty = renderer.draw(board, solver, loader)
+            recorder.capture_frame(win, changed=bool(dirty))
+
+    for piece, position in steps:
+        hold(step_time)
+        board.move(piece, position)
+    hold(END_TIME)
+    recorder.stop()
+    return len(steps)
+
+
+def render_layout(task):
+    # runs in the worker processes
+    layout_id, layout, error, output_dir, engine, fps, step_time = task
+    if error is not None:
+        return layout_id, None, error
+    out_file = os.path.join(output_dir, f'{layout_id}.avi')
+    try:
+        board = Board.from_layout(layout)
+    except (KeyError, TypeError, ValueError) as e:
+        return layout_id, None, str(e)
+    length = render_solution(board, out_file, engine, fps, step_time)
+    return layout_id, out_file, None if length is not None else 'no solution'
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Renders the solutions of klotski layouts to videos.')
+    parser.add_argument('input', nargs='?', type=FileType('r'),
+                        help='file of layouts (JSONL or text), - for stdin. default: the start position')
+    parser.add_argument('--output-dir', default='.', help='directory for the videos. default: .')
+    parser.add_argument('--solver', default='bfs', choices=list(SEARCHES),
+                        help='search engine, used when the distance table is not built. default: bfs')
+    parser.add_argument('--fps', type=int, default=60, help='frame rate of the videos. default: 60')
+    parser.add_argument('--step-time', type=float, default=STEP_TIME,
+                        help=f'seconds per step. default: {STEP_TIME}')
+    parser.add_argument('--processes', type=int, default=None, help='number of workers. default: number of cores')
+    args = parser.parse_args()
+
+    if args.input is None:
+        layouts = [('start', Board.from_start_position().layout, None)]
+    else:
+        layouts = read_layouts(args.input)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    tasks = ((layout_id, layout, error, args.output_dir, args.solver, args.fps, args.step_time)
+             for layout_id, layout, error in layouts)
+    with Pool(args.processes) as pool:
+        for layout_id, out_file, error in pool.imap_unordered(render_layout, tasks):
+            print(f'{layout_id}: {error}' if error else f'{layout_id}: {out_file}')
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+    Compact binary replays of games, and their fast re-simulation.
+
+        ./replay.py game.replay ...            # re-simulates the replays
+        ./replay.py --validate game.replay ... # checking every move is legal
+
+    A replay is the layout the game started from, followed by the moves taken
+    (by the player or the auto-solver) as the index of the piece and the cell it moved to:
+
+        header: magic, version, number of pieces, number of moves
+        layout: a byte per piece, the shape (see PIECE_NAMES) and the cell of the piece
+        moves: bit packed, each move takes as many bits as the piece index and the cell need,
+               eight moves fill a whole number of bytes and are packed together.
+"""
+import struct
+import sys
+import time
+from argparse import ArgumentParser
+
+from game import MOVE_TABLE, POSITIONS, PIECE_TYPES, TYPE_NAMES, Board, Position, to_cell
+
+MAGIC = b'KLRP'
+VERSION = 1
+# magic, version, number of pieces, number of moves
+HEADER = struct.Struct('<4sBBI')
+PIECE_NAMES = tuple(PIECE_TYPES)
+CELL_BITS = (len(POSITIONS) - 1).bit_length()
+# moves packed together, their bits add up to whole bytes
+GROUP = 8
+
+
+def _move_bits(pieces):
+    return max(1, (pieces - 1).bit_length()) + CELL_BITS
+
+
+def encode(layout, moves):
+    # layout is a list of (name, x, y), moves a list of (piece index, destination cell)
+    data = bytearray(HEADER.pack(MAGIC, VERSION, len(layout), len(moves)))
+    data += bytes(PIECE_NAMES.index(name) << CELL_BITS | to_cell(Position(x, y)) for name, x, y in layout)
+    bits = _move_bits(len(layout))
+    for start in range(0, len(moves), GROUP):
+        group = 0
+        for offset, (piece, cell) in enumerate(moves[start: start + GROUP]):
+            group |= (piece << CELL_BITS | cell) << (offset * bits)
+        # bits bytes hold GROUP moves, the last group is cut to the bytes used
+        size = bits if start + GROUP <= len(moves) else (bits * (len(moves) - start) + 7) // 8
+        data += group.to_bytes(size, 'little')
+    return bytes(data)
+
+
+def _size(pieces, count):
+    # bytes of a replay, see encode
+    bits = _move_bits(pieces)
+    return HEADER.size + pieces + count // GROUP * bits + (count % GROUP * bits + 7) // 8
+
+
+def decode(data):
+    # Returns the layout and the moves of the replay, see encode.
+    # Raises ValueError if the data is not a whole replay.
+    if len(data) < HEADER.size:
+        raise ValueError('Not a replay')
+    magic, version, pieces, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a replay')
+    if len(data) != _size(pieces, count):
+        raise ValueError(f'Replay of {count} moves must be {_size(pieces, count)} bytes, not {len(data)}')
+    offset = HEADER.size
+    cell_mask = (1 << CELL_BITS) - 1
+    layout = []
+    for value in data[offset: offset + pieces]:
+        shape, cell = value >> CELL_BITS, value & cell_mask
+        if shape >= len(PIECE_NAMES) or cell >= len(POSITIONS):
+            raise ValueError(f'Invalid piece {len(layout)} in the layout')
+        position = POSITIONS[cell]
+        layout.append((PIECE_NAMES[shape], position.x, position.y))
+    offset += pieces
+
+    bits = _move_bits(pieces)
+    move_mask = (1 << bits) - 1
+    moves = []
+    for start in range(0, count, GROUP):
+        group = int.from_bytes(data[offset: offset + bits], 'little')
+        offset += bits
+        for _ in range(min(GROUP, count - start)):
+            move = group & move_mask
+            group >>= bits
+            piece, cell = move >> CELL_BITS, move & cell_mask
+            if piece >= pieces or cell >= len(POSITIONS):
+                raise ValueError(f'Invalid move at step {len(moves) + 1}')
+            moves.append((piece, cell))
+    return layout, moves
+
+
+def from_board(board):
+    # the replay of the steps taken on the board, from the layout it started with
+    pieces = {piece: index for index, piece in enumerate(board.pieces)}
+    layout = [(TYPE_NAMES[type(piece)], *POSITIONS[cell]) for piece, cell in zip(board.pieces, board.snapshots[0])]
+    moves = [(pieces[piece], to_cell(position)) for piece, _, position in board.history[:board.number_of_steps]]
+    return encode(layout, moves)
+
+
+def save(board, path):
+    with open(path, 'wb') as f:
+        f.write(from_board(board))
+
+
+def simulate(data, validate=False):
+    # Replays the moves on a new board, returns the board.
+    # With validate, raises ValueError at the first illegal move.
+    # Without, only the cells are checked: moves which take a piece off the board
+    # or onto another piece raise ValueError, but not moves a piece could not slide.
+    layout, moves = decode(data)
+    # the layout is in the order of the pieces of the board, with the 2x2 last
+    board = Board.from_layout(layout)
+    pieces = board.pieces
+    # the footprints of each piece by cell, None where the piece does not fit
+    footprints = [MOVE_TABLE.footprints[piece.WIDTH, piece.HEIGHT] for piece in pieces]
+    for step, (index, cell) in enumerate(moves):
+        piece, position = pieces[index], POSITIONS[cell]
+        footprint = footprints[index][cell]
+        if footprint is None or footprint & ~(board.empty | piece.footprint) or \
+                validate and not board._can_move(piece, position):
+            raise ValueError(f'Illegal move at step {step + 1}')
+        board._move(piece, position)
+    return board
+
+
+def load(path, validate=False):
+    with open(path, 'rb') as f:
+        return simulate(f.read(), validate)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Re-simulates klotski replays.')
+    parser.add_argument('replays', nargs='+', help='replay files')
+    parser.add_argument('--validate', default=False, action='store_true', help='check that every move is legal')
+    args = parser.parse_args()
+
+    replays = []
+    for path in args.replays:
+        with open(path, 'rb') as f:
+            replays.append((path, f.read()))
+
+    start = time.perf_counter()
+    for path, data in replays:
+        try:
+            board = simulate(data, args.validate)
+        except ValueError as e:
+            print(f'{path}: {e}', file=sys.stderr)
+            continue
+        print(f"{path}: {board.number_of_steps} steps, {'solved' if board.is_solved else 'not solved'}")
+    elapsed = time.perf_counter() - start
+    print(f'Re-simulated {len(replays)} replays in {elapsed:.3f}s ({len(replays) / elapsed:.0f}/s).', file=sys.stderr)
@@ -1,171 +1,417 @@
 """
     Solves the klotski puzzle
 """
+import sys
+import time
+from array import array
+from collections import namedtuple
+from importlib.util import find_spec
+from functools import lru_cache, partial
+from heapq import heappop, heappush
+
+from bitboard import canonical, canonical_successors, encode, goal_states, is_solved, mirror, path_to_moves, \
+    shape_counts, unfold
+from game import Board as _Board
+from graph import canonical_neighbours, components
+from heuristics import get_heuristic
+from ranking import get_ranking, ranking_of
+
+# The searches are generators yielding Progress events, and return the path found (None if the
+# goal is not reachable) when exhausted. They can be cancelled by no longer iterating over them.
+# A last Progress event with the final counts is yielded when the goal is found.
+Progress = namedtuple('Progress', ['depth', 'expanded', 'frontier'])
+# number of states expanded between progress events
+PROGRESS_INTERVAL = 1000
+# states remembered by the transposition table of IDA*
+TRANSPOSITION_SIZE = 500000
+
+
+class SearchStats:
+    """
+        Metrics of a search, updated at every progress event.
+        Pass one to a solver to inspect it afterwards, the return value of the solver is unchanged.
+        The callback, if any, is called with the stats at every progress event.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.depth = 0  # BFS level, or the f-cost bound for A* and IDA*
+        self.expanded = 0  # states expanded
+        self.duplicates = 0  # successors which were already seen
+        self.frontier = 0
+        self.peak_frontier = 0
+        self.visited = 0  # number of states remembered
+        self.level_times = []  # seconds spent on each completed level
+        self.bytes_per_state = None  # approximate memory of a remembered state, set when done
+        self.start_time = self.level_start_time = time.perf_counter()
+        self.elapsed = 0
+
+    @property
+    def nodes_per_sec(self):
+        return self.expanded / self.elapsed if self.elapsed else 0
+
+    def update(self, depth, expanded, frontier, duplicates, visited):
+        # records the counts of the search, returns the Progress event to yield
+        now = time.perf_counter()
+        if depth != self.depth:
+            self.level_times.append(now - self.level_start_time)
+            self.level_start_time = now
+        self.depth, self.expanded, self.frontier = depth, expanded, frontier
+        self.duplicates, self.visited = duplicates, visited
+        self.peak_frontier = max(self.peak_frontier, frontier)
+        self.elapsed = now - self.start_time
+        if self.callback is not None:
+            self.callback(self)
+        return Progress(depth, expanded, frontier)
+
+    def measure(self, *containers):
+        # estimates the bytes per state held in the containers (dicts or sets of states)
+        states = sum(len(container) for container in containers)
+        if states:
+            sample = next(iter(containers[0]))
+            size = sum(sys.getsizeof(container) for container in containers)
+            self.bytes_per_state = size / states + sys.getsizeof(sample)
+
+
+# NOTE: The searches run on canonical states (see bitboard.canonical), which folds every board
+# with its mirror image. The paths found are unfolded into real moves from the start state.
+
+def rebuild_path(parents, state):
+    # follows the parent links back to the start state
+    path = []
+    while state is not None:
+        path.append(state)
+        state = parents[state]
+    path.reverse()
+    return path
+
+
+def _expand(frontier, links, other_links, stats):
+    # Expands a whole level of one side of the bidirectional search.
+    # Returns the next level and the state where the two searches met, if any.
+    new_frontier = []
+    expanded, duplicates = stats.expanded, stats.duplicates
+    for state in frontier:
+        expanded += 1
+        if not expanded % PROGRESS_INTERVAL:
+            yield stats.update(stats.depth, expanded, stats.frontier, duplicates, len(links) + len(other_links))
+        for new_state in canonical_successors(state):
+            if new_state in links:
+                duplicates += 1
+                continue
+            links[new_state] = state
+            if new_state in other_links:
+                stats.update(stats.depth, expanded, stats.frontier, duplicates, len(links) + len(other_links))
+                return new_frontier, new_state
+            new_frontier.append(new_state)
+    stats.update(stats.depth, expanded, stats.frontier, duplicates, len(links) + len(other_links))
+    return new_frontier, None
+
+
+@lru_cache(maxsize=None)
+def goal_components(counts):
+    # Labels the connected components of the canonical states from which the goal can be reached,
+    # for the pieces of counts. Returns the label of every state by rank (-1 if the goal cannot be
+    # reached from it) and the canonical goal states of every component.
+    # Computed once for a set of pieces, by a search from all the goal states.
+    ranking = get_ranking(counts)
+    goals = list(dict.fromkeys(canonical(state) for state in goal_states(ranking.unrank(0))))
+    labels, sizes = components(ranking.size, canonical_neighbours(ranking), (ranking.rank(goal) for goal in goals))
+    goals_by_label = [[] for _ in sizes]
+    for goal in goals:
+        goals_by_label[labels[ranking.rank(goal)]].append(goal)
+    return labels, goals_by_label
+
+
+def bidirectional_search(start_state, stats=None):
+    # Searches forward from the start state and backward from the goal states it can reach,
+    # at the same time, until the two meet.
+    # NOTE: As whole levels are expanded at a time, the first state the searches meet at
+    # lies on a shortest path.
+    stats = stats or SearchStats()
+    if is_solved(start_state):
+        return [start_state]
+    # Only the goal states in the component of the start state are searched from, the others
+    # would grow the backward search over every other component (see goal_components).
+    # NOTE: Labelling the components visits every state from which the goal can be reached,
+    # more than a BFS from the start visits, so the first search of a process is slower than BFS.
+    labels, goals = goal_components(shape_counts(start_state))
+    label = labels[ranking_of(start_state).rank(canonical(start_state))]
+    if label < 0:
+        return None
+    # parents of the forward search, and the next state towards the goal for the backward search
+    parents = {start_state: None}
+    children = dict.fromkeys(goals[label])
+    forward, backward = [start_state], list(children)
+    depth = 0
+    while forward and backward:
+        yield stats.update(depth, stats.expanded, len(forward) + len(backward), stats.duplicates,
+                           len(parents) + len(children))
+        # grow the side with the smaller frontier
+        if len(forward) <= len(backward):
+            forward, meeting_state = yield from _expand(forward, parents, children, stats)
+        else:
+            backward, meeting_state = yield from _expand(backward, children, parents, stats)
+        depth += 1
+
+        if meeting_state is not None:
+            yield stats.update(depth, stats.expanded, len(forward) + len(backward), stats.duplicates,
+                               len(parents) + len(children))
+            stats.measure(parents, children)
+            path = rebuild_path(parents, meeting_state)
+            state = children[meeting_state]
+            while state is not None:
+                path.append(state)
+                state = children[state]
+            return path
+    return None
+
+
+def bfs_search(start_state, stats=None):
+    # BFS Algorithm to find shortest route to solution, one level at a time
+    # parents maps each discovered state to the state it was reached from,
+    # it doubles as the visited set.
+    stats = stats or SearchStats()
+    parents = {start_state: None}
+    new_states = [start_state]
+    depth = expanded = duplicates = 0
+    while new_states:
+        yield stats.update(depth, expanded, len(new_states), duplicates, len(parents))
+        frontier, new_states = new_states, []
+        for state in frontier:
+            if is_solved(state):
+                # Found the solution
+                yield stats.update(depth, expanded, len(frontier) + len(new_states), duplicates, len(parents))
+                stats.measure(parents)
+                return rebuild_path(parents, state)
+
+            expanded += 1
+            if not expanded % PROGRESS_INTERVAL:
+                yield stats.update(depth, expanded, len(frontier) + len(new_states), duplicates, len(parents))
+            for new_state in canonical_successors(state):
+                if new_state not in parents:  # O(1)
+                    parents[new_state] = state
+                    new_states.append(new_state)
+                else:
+                    duplicates += 1
+        depth += 1
+
+    # No solution reachable
+    return None
+
+
+def astar_search(start_state, stats=None, heuristic='pdb'):
+    # A* with a consistent heuristic, the first time the goal is popped its path is the shortest.
+    # Ties are broken towards deeper states, which are closer to the goal.
+    stats = stats or SearchStats()
+    heuristic = get_heuristic(heuristic, start_state)
+    parents = {start_state: None}
+    costs = {start_state: 0}
+    open_states = [(heuristic(start_state), 0, start_state)]
+    expanded = duplicates = 0
+    while open_states:
+        estimate, cost, state = heappop(open_states)
+        cost = -cost
+        if cost > costs[state]:
+            # stale entry, the state was reached with a lower cost later
+            continue
+        if is_solved(state):
+            yield stats.update(estimate, expanded, len(open_states), duplicates, len(costs))
+            stats.measure(parents, costs)
+            return rebuild_path(parents, state)
+
+        expanded += 1
+        if not expanded % PROGRESS_INTERVAL:
+            yield stats.update(estimate, expanded, len(open_states), duplicates, len(costs))
+        for new_state in canonical_successors(state):
+            if cost + 1 < costs.get(new_state, cost + 2):
+                costs[new_state] = cost + 1
+                parents[new_state] = state
+                heappush(open_states, (cost + 1 + heuristic(new_state), -cost - 1, new_state))
+            else:
+                duplicates += 1
+    return None
+
+
+def idastar_search(start_state, stats=None, heuristic='pdb'):
+    # Iterative deepening A*, memory is bounded by the transposition table.
+    # The table keeps the lowest cost each state was reached with in the current iteration,
+    # a state reached again at no lower cost is not searched again. Once the table is full,
+    # only the states on the current path are remembered to avoid cycles.
+    stats = stats or SearchStats()
+    heuristic = get_heuristic(heuristic, start_state)
+    path = [start_state]
+    on_path = {start_state}
+    costs = {}
+    expanded = duplicates = 0
+
+    def search(cost, bound):
+        # returns True once solved, otherwise the lowest f-cost beyond the bound
+        nonlocal expanded, duplicates
+        state = path[-1]
+        if len(costs) < TRANSPOSITION_SIZE or state in costs:
+            costs[state] = cost
+        estimate = cost + heuristic(state)
+        if estimate > bound:
+            return estimate
+        if is_solved(state):
+            return True
+
+        expanded += 1
+        if not expanded % PROGRESS_INTERVAL:
+            yield stats.update(bound, expanded, len(path), duplicates, len(costs))
+        lowest = None
+        # try the most promising moves first
+        for new_state in sorted(canonical_successors(state), key=heuristic):
+            if new_state in on_path or costs.get(new_state, cost + 2) <= cost + 1:
+                duplicates += 1
+                continue
+            path.append(new_state)
+            on_path.add(new_state)
+            result = yield from search(cost + 1, bound)
+            if result is True:
+                return True
+            path.pop()
+            on_path.remove(new_state)
+            if result is not None and (lowest is None or result < lowest):
+                lowest = result
+        return lowest
+
+    bound = heuristic(start_state)
+    while True:
+        yield stats.update(bound, expanded, len(path), duplicates, len(costs))
+        costs.clear()
+        result = yield from search(0, bound)
+        if result is True:
+            yield stats.update(bound, expanded, len(path), duplicates, len(costs))
+            stats.measure(costs)
+            return path
+        if result is None:
+            # every path is a dead end
+            return None
+        bound = result
+
+
+def numpy_search(start_state, stats=None):
+    # Level at a time BFS with numpy, see numpy_solver.
+    # imported here, as numpy is slow to load and only needed for this engine
+    from numpy_solver import numpy_search as _numpy_search
+    return (yield from _numpy_search(start_state, stats))
+
+
+# Search engines selectable by name, each returns the shortest path of canonical states
+SEARCHES = {
+    'bfs': bfs_search,
+    'bidirectional': bidirectional_search,
+    'astar': astar_search,
+    'idastar': idastar_search,
+}
+# numpy is optional
+if find_spec('numpy') is not None:
+    SEARCHES['numpy'] = numpy_search
+
+
+def search(state, engine='bfs', stats=None, **options):
+    # Generator searching for the shortest path of states from state to the goal.
+    # Yields Progress events, returns the path or None if unsolvable.
+    # options are passed on to the engine, such as the heuristic of astar and idastar.
+    # Works on encoded states only, so it is cheap to run in another process.
+    path = yield from SEARCHES[engine](canonical(state), stats=stats, **options)
+    return unfold(path, state) if path else None
+
+
+def complete(_search):
+    # runs a search to the end, returns its result
+    while True:
+        try:
+            next(_search)
+        except StopIteration as stop:
+            return stop.value
+
+
+def solve(state, engine='bfs', stats=None, **options):
+    # Returns the shortest path of states from state to the goal, None if unsolvable.
+    return complete(search(state, engine, stats, **options))
+
+
+def _to_moves(path, _board):
+    # maps a path of states to the moves of the pieces of _board
+    return path_to_moves(path, _board) if path else []
+
+
+def bfs_solver(_board: _Board, bidirectional=False, stats=None):
+    return _to_moves(solve(encode(_board), 'bidirectional' if bidirectional else 'bfs', stats), _board)
+
+
+def astar_solver(_board: _Board, stats=None, heuristic='pdb'):
+    return _to_moves(solve(encode(_board), 'astar', stats, heuristic=heuristic), _board)
+
+
+def idastar_solver(_board: _Board, stats=None, heuristic='pdb'):
+    return _to_moves(solve(encode(_board), 'idastar', stats, heuristic=heuristic), _board)
+
+
+def numpy_solver(_board: _Board, stats=None):
+    return _to_moves(solve(encode(_board), 'numpy', stats), _board)
+
+
+# Solvers selectable by name, they all return the optimal list of (piece, position)
+SOLVERS = {
+    'bfs': bfs_solver,
+    'bidirectional': partial(bfs_solver, bidirectional=True),
+    'astar': astar_solver,
+    'idastar': idastar_solver,
+}
+if 'numpy' in SEARCHES:
+    SOLVERS['numpy'] = numpy_solver
 
-from game import Piece1x1 as _Piece1x1, Piece1x2 as _Piece1x2, Piece2x1 as _Piece2x1, Piece2x2 as _Piece2x2, \
-    Board as _Board
-
-
-class Piece1x1(_Piece1x1):
-    def update_position(self, position):
-        return Piece1x1(position.x, position.y)
-
-    def __hash__(self):
-        return hash(('PIECE1x1', self.position))
-
-    @classmethod
-    def from_piece(cls, piece):
-        return cls(piece.position.x, piece.position.y)
-
-
-class Piece1x2(_Piece1x2):
-    def update_position(self, position):
-        return Piece1x2(position.x, position.y)
-
-    def __hash__(self):
-        return hash(('PIECE1x2', self.position))
-
-    @classmethod
-    def from_piece(cls, piece):
-        return cls(piece.position.x, piece.position.y)
-
-
-class Piece2x1(_Piece2x1):
-    def update_position(self, position):
-        return Piece2x1(position.x, position.y)
-
-    def __hash__(self):
-        return hash(('PIECE2x1', self.position))
-
-    @classmethod
-    def from_piece(cls, piece):
-        return cls(piece.position.x, piece.position.y)
-
-
-class Piece2x2(_Piece2x2):
-    def update_position(self, position):
-        return Piece2x2(position.x, position.y)
-
-    def __hash__(self):
-        return hash(('PIECE2x2', self.position))
-
-    @classmethod
-    def from_piece(cls, piece):
-        return cls(piece.position.x, piece.position.y)
-
-
-class Board(_Board):
-    def move(self, piece, position):
-        pieces = tuple(
-            _piece if _piece != piece
-            else piece.update_position(position)
-            for _piece in self.pieces
-        )
-        return Board.from_pieces(pieces)
-
-    def potential_moves(self):
-        moves = []
-        empty_positions = self.empty_positions()
-        for piece in self.pieces:
-            for position in piece.possible_moves(empty_positions):
-                moves.append((piece, position))
-        return moves
-
-    def __hash__(self):
-        return hash(frozenset(self.pieces))
-
-    def __eq__(self, other):
-        return hash(self) == hash(other)
-
-    @classmethod
-    def from_pieces(cls, pieces: tuple):
-        return cls(pieces)
 
-    @classmethod
-    def from_board(cls, _board: _Board):
-        pieces = []
-        for piece in _board.pieces:
-            if isinstance(piece, _Piece1x1):
-                pieces.append(Piece1x1.from_piece(piece))
-            elif isinstance(piece, _Piece1x2):
-                pieces.append(Piece1x2.from_piece(piece))
-            elif isinstance(piece, _Piece2x1):
-                pieces.append(Piece2x1.from_piece(piece))
-            elif isinstance(piece, _Piece2x2):
-                pieces.append(Piece2x2.from_piece(piece))
-            else:
-                raise NotImplemented
-        return cls.from_pieces(tuple(pieces))
-
-    def map_piece(self, piece, _board: _Board):
-        # Returns the corresponding piece in _board O(1)
-        return _board.pieces[self.pieces.index(piece)]
-
-
-def bfs_solver(_board: _Board):
-    start_board = Board.from_board(_board)
-    # BFS Algorithm to find shortest route to solution
-    visited_boards = set()
-
-    # list maintains bfs order, set is O(log n) search
-    new_boards = [start_board]
-    new_boards_set = {start_board}
-    transitions = {}
-    board = None
-    while new_boards:
-        # explore the first element of the list
-        board = new_boards.pop(0)  # O(1)
-        new_boards_set.remove(board)  # O(log n)
-
-        if board.is_solved:
-            # Found the solution
-            break
-
-        # mark as visited
-        visited_boards.add(board)
-        for piece, move in board.potential_moves():
-            # go to new board to explore it.
-            new_board = board.move(piece, move)
-            if new_board not in visited_boards and \
-                    new_board not in new_boards_set:  # O(log n)
-                new_boards.append(new_board)  # to maintain order
-                new_boards_set.add(new_board)  # for searching
-
-                # Apply move to piece in board to go to new_board
-                # NOTE: Also map to piece in the _board, as pieces in Board as immutable,
-                # while _Board maintains same set of pieces.
-                transitions[new_board] = (board, board.map_piece(piece, _board), move)
-
-    # The obtained solution
-    # solution_board = board
-    moves_taken = []
-    while board != start_board:
-        board, piece, move = transitions[board]
-        moves_taken.insert(0, (piece, move))
-    return moves_taken
-
-
-def explore_states():
+def explore_states(stats=None):
     # Used for exploration and analysis
-    initial_board = Board.from_board(_Board.from_start_position())
-
-    visited_boards = set()
-    new_boards = {initial_board}
-
-    while new_boards:
-        board = new_boards.pop()
-        visited_boards.add(board)
-        for piece, move in board.potential_moves():
-            # go to new board to explore it.
-            new_board = board.move(piece, move)
-            if new_board not in visited_boards:
-                new_boards.add(new_board)
-
-    total_boards = len(visited_boards)
-    # Visited Boards contain all the boards reachable from initial_position
-    solution_boards = sum(board.is_solved for board in visited_boards)
+    # Returns the ranking of the start position and the visited states, a bytearray indexed by rank
+    # holding 1 for the canonical states of all the boards reachable from the start position.
+    # The states are recovered with ranking.unrank where needed.
+    stats = stats or SearchStats()
+    initial_state = canonical(encode(_Board.from_start_position()))
+
+    # visited states are marked by their rank, a byte per placement of the pieces,
+    # and the states to expand are kept by rank as well, 4 bytes each
+    ranking = ranking_of(initial_state)
+    visited = bytearray(ranking.size)
+    initial_index = ranking.rank(initial_state)
+    visited[initial_index] = 1
+    new_states = array('I', [initial_index])
+    expanded = duplicates = 0
+    visited_count = 1
+    # count both a board and its mirror image unless they are the same
+    total_boards = 1 if mirror(initial_state) == initial_state else 2
+    solution_boards = total_boards if is_solved(initial_state) else 0
+
+    while new_states:
+        state = ranking.unrank(new_states.pop())
+        expanded += 1
+        if not expanded % PROGRESS_INTERVAL:
+            stats.update(0, expanded, len(new_states), duplicates, visited_count)
+        for new_state in canonical_successors(state):
+            index = ranking.rank(new_state)
+            if not visited[index]:
+                visited[index] = 1
+                visited_count += 1
+                new_states.append(index)
+                weight = 1 if mirror(new_state) == new_state else 2
+                total_boards += weight
+                solution_boards += weight if is_solved(new_state) else 0
+            else:
+                duplicates += 1
+    stats.update(0, expanded, 0, duplicates, visited_count)
+    stats.bytes_per_state = (sys.getsizeof(visited) + stats.peak_frontier * new_states.itemsize) / visited_count
+
     print(f"Possible board configurations are {total_boards}, of which {solution_boards} are solutions.")
+    return ranking, visited
 
 
 if __name__ == '__main__':
-    explore_states()
\ No newline at end of file
+    _stats = SearchStats()
+    explore_states(_stats)
+    print(f"Expanded {_stats.expanded} states ({_stats.nodes_per_sec:.0f}/s), {_stats.duplicates} duplicates, "
+          f"peak frontier {_stats.peak_frontier}, ~{_stats.bytes_per_state:.0f} bytes per state.")
@@ -1,10 +1,11 @@
+import pygame
 from pygame.draw import rect as draw_rect
 
 def darken_color(color, factor):
     return tuple(int(c * factor) for c in color)
 
 
-def draw_piece(surf, color, left, top, width, height, size):
+def render_piece(surf, color, left, top, width, height, size):
     padding_factor = 0.025
     shadow_factor = 0.085
     margin_factor = 0.05
@@ -30,3 +31,27 @@ def draw_piece(surf, color, left, top, width, height, size):
     # Draw margins
     draw_rect(surf, margin_color, top_rect, int(size * margin_factor))
 
+
+# Pieces rendered once, keyed by (color, width, height)
+# all for the same tile size, the cache is cleared when it changes.
+_sprites = {}
+_sprite_size = None
+
+
+def get_sprite(color, width, height, size):
+    global _sprite_size
+    if size != _sprite_size:
+        _sprites.clear()
+        _sprite_size = size
+    key = color, width, height
+    sprite = _sprites.get(key)
+    if sprite is None:
+        # transparent around the piece, so the board shows through the padding
+        sprite = pygame.Surface((width, height), pygame.SRCALPHA)
+        render_piece(sprite, color, 0, 0, width, height, size)
+        _sprites[key] = sprite
+    return sprite
+
+
+def draw_piece(surf, color, left, top, width, height, size):
+    surf.blit(get_sprite(color, width, height, size), (left, top))